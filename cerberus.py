@@ -1,14 +1,20 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
+from os import path
 from random import random, choice, choices
 # from datetime import timedelta
-from typing import List
+from typing import List, Callable, Awaitable
 from logger import get_logger
 # from asyncio import Semaphore
 
 from kerb3r.bot import Bot
+from kerb3r.sharding import Coordinator
+from kerb3r.workqueue import Priority
+from kerb3r.profiling import Profiler
+from kerb3r.journal import Journal, Operation
 from kerb3r.wiki import Wiki, ForumThread, Page
+from kerb3r.cache import ResponseCache
 from kerb3r.utils import include_tags_or_category, exclude_tags_or_category, now, never
-from config import config, extract_period, API_TOKEN, DEBUG
+from config import config, extract_period, API_TOKEN, WORKER_ID, DEBUG
 
 
 logger = get_logger(
@@ -16,8 +22,53 @@ logger = get_logger(
     debug=DEBUG
 )
 
-wiki = Wiki(config("wiki_base_url"))
-bot = Bot(wiki).auth(API_TOKEN)
+def worker_path(file_path: str) -> str:
+    if WORKER_ID:
+        return path.join(path.dirname(file_path), f"{WORKER_ID}.{path.basename(file_path)}")
+    return file_path
+
+
+wiki = Wiki(config("wiki_base_url"), response_cache=ResponseCache(
+    max_entries=config("runtime.response_cache.max_entries", 1024),
+    max_bytes=config("runtime.response_cache.max_megabytes", 64) * 1024 * 1024
+))
+bot = Bot(wiki).auth(API_TOKEN).runtime(
+    uvloop=config("runtime.uvloop", False),
+    fast_json=config("runtime.fast_json", False)
+).snapshot(
+    path=worker_path(config("runtime.snapshot.path")),
+    period=extract_period(config("runtime.snapshot.period")),
+    ttl=extract_period(config("runtime.snapshot.ttl")),
+    max_idle=extract_period(config("runtime.snapshot.max_idle")) if config("runtime.snapshot.max_idle") else None
+).work_queue(
+    concurrency=config("runtime.queue.concurrency", 1),
+    requests_per_second=config("runtime.queue.requests_per_second"),
+    max_pending=config("runtime.queue.max_pending")
+).profiling(Profiler(
+    output_dir=config("logs_dir"),
+    slow_callback=config("runtime.profiling.slow_callback"),
+    sample_duration=config("runtime.profiling.sample_duration", 30),
+    sample_interval=config("runtime.profiling.sample_interval", 0.005)
+)).adaptive_periods(
+    tighten_rate=config("runtime.adaptive.tighten_rate", 0.05),
+    relax_rate=config("runtime.adaptive.relax_rate", 0.01)
+).action_journal(
+    Journal(
+        path=worker_path(config("runtime.journal.path")),
+        fsync_batch=config("runtime.journal.fsync_batch", 32)
+    ),
+    checkpoint_period=extract_period(config("runtime.journal.checkpoint_period"))
+)
+
+if WORKER_ID:
+    bot.shard(Coordinator(
+        path=config("runtime.sharding.db"),
+        worker_id=WORKER_ID,
+        lease=extract_period(config("runtime.sharding.lease")).total_seconds()
+    ))
+
+MIN_WORK_PERIOD = extract_period(config("runtime.adaptive.min_period", config("runtime.work_period")))
+MAX_WORK_PERIOD = extract_period(config("runtime.adaptive.max_period", config("runtime.work_period")))
 
 
 def get_random_deletion_phrase():
@@ -35,23 +86,44 @@ def get_random_deletion_phrase():
     )
 
 
+async def get_deadline(page: Page, kind: str, delay: timedelta, get_start: Callable[[], Awaitable[datetime | None]]) -> datetime | None:
+    fingerprint = f"{page.revision}:{int(delay.total_seconds())}"
+    deadline = bot.deadlines.get(page.name, kind, fingerprint)
+
+    if deadline is None:
+        start = await get_start()
+        if start is None:
+            return None
+        deadline = start + delay
+        if deadline > now():
+            bot.deadlines.set(page.name, kind, deadline, fingerprint)
+
+    return deadline
+
+
+async def is_deadline_reached(page: Page, kind: str, delay: timedelta, get_start: Callable[[], Awaitable[datetime | None]]) -> bool:
+    deadline = await get_deadline(page, kind, delay, get_start)
+    return deadline is not None and now() >= deadline
+
+
 async def is_in_grayzone(page: Page) -> bool:
     if page.rating > config("critical.rating") and page.popularity < config("critical.popularity"):
-        last_category_move = await page.get_last_category_move()
-        if now() - last_category_move.createdAt >= extract_period(config("grayzone.delay")):
-            return True
+        async def get_last_category_move_date():
+            return (await page.get_last_category_move()).createdAt
+
+        return await is_deadline_reached(page, "grayzone", extract_period(config("grayzone.delay")), get_last_category_move_date)
     return False
 
 
 async def is_in_progress_expired(page: Page) -> bool:
-    return now() - (await page.get_last_source_edit()).createdAt >= extract_period(config("in_progress.delay"))
+    async def get_last_source_edit_date():
+        return (await page.get_last_source_edit()).createdAt
+
+    return await is_deadline_reached(page, "in_progress", extract_period(config("in_progress.delay")), get_last_source_edit_date)
 
 
 async def is_last_chance_expired(page: Page) -> bool:
-    tag_date = await page.get_tag_date(config("tags.deletion"))
-    if tag_date:
-        return now() - tag_date >= extract_period(config("critical.delay"))
-    return False
+    return await is_deadline_reached(page, "last_chance", extract_period(config("critical.delay")), lambda: page.get_tag_date(config("tags.deletion")))
 
 
 def is_critical_rating_reached(page: Page) -> bool:
@@ -64,13 +136,77 @@ def is_approval_rating_reached(page: Page) -> bool:
 
 async def is_ready_for_approval(page: Page) -> bool:
     if is_approval_rating_reached(page):
-        tag_date = await page.get_tag_date(config("tags.whitemark"))
-        if tag_date:
-            return now() - tag_date >= extract_period(config("approval.delay"))
-        return False
+        return await is_deadline_reached(page, "approval", extract_period(config("approval.delay")), lambda: page.get_tag_date(config("tags.whitemark")))
     return False
 
 
+def format_report_line(page: Page) -> str:
+    return config("report.line") \
+        .format(title=page.title, rating=page.rating, votes=page.votes_count, popularity=page.popularity, author=page.author.username, tags=", ".join(map(lambda t: "**"+t.replace(":", ":**", 1) if ":" in t else t, page.tags)))
+
+
+async def check_renamed(page_id: str, new_page_id: str) -> str | None:
+    if not await wiki.page_exists(page_id) and await wiki.page_exists(new_page_id):
+        return new_page_id
+    return None
+
+
+async def check_deleted(page_id: str) -> bool | None:
+    return None if await wiki.page_exists(page_id) else True
+
+
+async def check_posted(thread_id: str) -> dict:
+    # Forum posts can not be looked up, so possibly sent post is not repeated
+    logger.warning(f"Сообщение в обсуждение {thread_id} могло быть отправлено до остановки, повторно не отправляется")
+    return {"status": "unconfirmed"}
+
+
+async def is_still_critical(page_id: str) -> bool:
+    if not await wiki.page_exists(page_id):
+        return False
+    return is_critical_rating_reached(await Page(wiki, page_id).fetch())
+
+
+async def is_still_deletable(page_id: str) -> bool:
+    # Already deleted page is recognized by the check of the delete step
+    if not await wiki.page_exists(page_id):
+        return True
+    page = await Page(wiki, page_id).fetch()
+    return is_critical_rating_reached(page) and await is_last_chance_expired(page)
+
+
+@bot.action()
+async def archive_page(operation: Operation, page_id: str, source: str) -> str:
+    thread_id = await operation.step("get_thread", lambda: wiki.get_thread_id(page_id))
+    new_page_id = await operation.step("rename", lambda: Page(wiki, page_id).rename(f"deleted:{page_id}"), check=lambda: check_renamed(page_id, f"deleted:{page_id}"))
+    await operation.step("clear_tags", lambda: Page(wiki, new_page_id).set_tags({}))
+    await operation.step("post", lambda: ForumThread(wiki, thread_id).new_post(title=config("posting.title"), source=source), check=lambda: check_posted(thread_id))
+    bot.deadlines.discard(page_id)
+    return new_page_id
+
+
+@bot.action(recheck=is_still_critical)
+async def mark_for_deletion(operation: Operation, page_id: str, source: str):
+    await operation.step("add_tags", lambda: Page(wiki, page_id).add_tags([config("tags.deletion")]))
+    thread_id = await operation.step("get_thread", lambda: wiki.get_thread_id(page_id))
+    await operation.step("post", lambda: ForumThread(wiki, thread_id).new_post(title=config("posting.title"), source=source), check=lambda: check_posted(thread_id))
+
+
+@bot.action()
+async def untag_page(operation: Operation, page_id: str, tags: List[str]) -> List[str]:
+    removed_tags = await operation.step("remove_tags", lambda: Page(wiki, page_id).remove_tags(tags, lazy=False))
+    thread_id = await operation.step("get_thread", lambda: wiki.get_thread_id(page_id))
+    await operation.step("post", lambda: ForumThread(wiki, thread_id).new_post(title=config("posting.title"), source=config("posting.phrases.tags_prohibited")), check=lambda: check_posted(thread_id))
+    return removed_tags
+
+
+# Stays pending until the deletion is reported
+@bot.action(complete=False, recheck=is_still_deletable, leader_only=True)
+async def delete_page(operation: Operation, page_id: str, report_line: str):
+    await operation.step("delete", lambda: Page(wiki, page_id).delete_page(), check=lambda: check_deleted(page_id))
+    bot.deadlines.discard(page_id)
+
+
 # global_last_pages_registry_update = never()
 # global_pages_registry = []
 # sem = Semaphore()
@@ -106,58 +242,50 @@ async def on_shutdown():
     logger.warning(f"Cerberus.aic v{config("version")} завершает работу")
 
 
-@bot.task(period=extract_period(config("runtime.work_period")))
+@bot.task(period=extract_period(config("runtime.work_period")), deadlines=["grayzone"], min_period=MIN_WORK_PERIOD, max_period=MAX_WORK_PERIOD)
 async def mark_for():
-    target_pages = await bot.list_pages(
+    target_pages = bot.iter_pages(
         category=" ".join(config("deletion.categories")),
         tags=" ".join(config("deletion.branch_tags") + exclude_tags_or_category([config("tags.deletion"), config("tags.whitemark"), config("tags.approved")] + config("tags.exclude_with"))),
     )
 
-    for page in target_pages:
+    async def process(page: Page):
         await page.fetch()
 
         if await is_in_grayzone(page):
-            prev_name = page.name
-            thread = await page.get_thread()
-            await page.rename(f"deleted:{page.name}")
-            await page.set_tags({})
-            await thread.new_post(
-                title=config("posting.title"),
+            new_name = await archive_page(
+                page.name,
                 source=config("posting.phrases.grayzone") \
                 .format(
                     popularity=page.popularity,
                     votes=page.votes_count
                 )
             )
-            logger.info(f"Перенесено в архив удаленных: {prev_name} -> {page}")
+            logger.info(f"Перенесено в архив удаленных: {page} -> {new_name}")
 
         elif is_approval_rating_reached(page):
             await page.add_tags([config("tags.whitemark")])
             logger.info(f"Проходной рейтинг набран: {page}")
 
         elif  is_critical_rating_reached(page):
-            await page.add_tags([config("tags.deletion")])
-            logger.info(f"Помечено для удаления: {page}")
-            
-            thread = await page.get_thread()
             deletion_phrase = get_random_deletion_phrase()
-            await thread.new_post(
-                title=config("posting.title"),
-                source=deletion_phrase
-            )
+            await mark_for_deletion(page.name, source=deletion_phrase)
+            logger.info(f"Помечено для удаления: {page}")
             logger.info(f"На странице обсуждения {page.name} оставлено сообщение: {deletion_phrase}")
 
+    await bot.process(process, target_pages, Priority.High, skip_unchanged=True)
 
-@bot.task(period=extract_period(config("runtime.deletion_period")))
+
+@bot.task(period=extract_period(config("runtime.deletion_period")), leader_only=True, deadlines=["last_chance"])
 async def delete_marked():
-    target_pages = await bot.list_pages(
+    # Task runs on the leader only, so it handles pages of all workers
+    target_pages = bot.iter_pages(
+        all_shards=True,
         category=" ".join(config("deletion.categories")),
         tags=" ".join(config("deletion.branch_tags") + include_tags_or_category([config("tags.deletion")]) + exclude_tags_or_category(config("tags.exclude_with")))
     )
-    
-    deleted_pages: List[Page] = []
 
-    for page in target_pages:
+    async def process(page: Page):
         await page.fetch()
 
         if not is_critical_rating_reached(page):
@@ -165,34 +293,36 @@ async def delete_marked():
             logger.info(f"Метка к удалению снята: {page}")
 
         elif await is_last_chance_expired(page):
-            await page.delete_page()
-            deleted_pages.append(page)
+            await delete_page(page.name, report_line=format_report_line(page))
             logger.info(f"Страница удалена безвозвратно: {page}")
 
+    await bot.process(process, target_pages, Priority.Critical, skip_unchanged=True)
+
+    deleted_pages = [operation for operation in bot.journal.pending("delete_page") if operation.is_done("delete")]
+
     if deleted_pages:
         report_thread = ForumThread(wiki, config("report.thread"))
         deletion_message = \
             config("report.prepend") + "\n" + \
-            "\n".join([
-                config("report.line") \
-                .format(title=page.title, rating=page.rating, votes=page.votes_count, popularity=page.popularity, author=page.author.username, tags=", ".join(map(lambda t: "**"+t.replace(":", ":**", 1) if ":" in t else t, page.tags)))
-                for page in deleted_pages
-            ])
+            "\n".join([operation.args["report_line"] for operation in deleted_pages])
 
         await report_thread.new_post(
             title=config("report.title"),
             source=deletion_message
         )
 
+        for operation in deleted_pages:
+            operation.complete()
 
-@bot.task(period=extract_period(config("runtime.work_period")))
+
+@bot.task(period=extract_period(config("runtime.work_period")), deadlines=["approval"], min_period=MIN_WORK_PERIOD, max_period=MAX_WORK_PERIOD)
 async def approve_marked():
-    target_pages = await bot.list_pages(
+    target_pages = bot.iter_pages(
         category=" ".join(config("deletion.categories")),
         tags=" ".join(config("deletion.branch_tags") + include_tags_or_category([config("tags.whitemark")]) + exclude_tags_or_category([config("tags.approved")] + config("tags.exclude_with"))),
     )
 
-    for page in target_pages:
+    async def process(page: Page):
         await page.fetch()
 
         if await is_ready_for_approval(page):
@@ -205,41 +335,34 @@ async def approve_marked():
             await page.remove_tags([config("tags.whitemark")])
             logger.info(f"Проходной рейтинг утрачен: {page}")
 
+    await bot.process(process, target_pages, Priority.Normal, skip_unchanged=True)
+
 
-@bot.task(period=extract_period(config("runtime.work_period")))
+@bot.task(period=extract_period(config("runtime.work_period")), deadlines=["in_progress"], min_period=MIN_WORK_PERIOD, max_period=MAX_WORK_PERIOD)
 async def handle_in_progress_articles():
-    target_pages = await bot.list_pages(
+    target_pages = bot.iter_pages(
         category=" ".join(config("in_progress.categories")),
         tags=" ".join(config("deletion.branch_tags") + exclude_tags_or_category(config("tags.exclude_with"))),
     )
 
     unwanted_tags = {config("tags.approved"), config("tags.tagging"), config("tags.whitemark"), config("tags.deletion")}
 
-    for page in target_pages:
+    async def process(page: Page):
         await page.fetch()
 
         if await is_in_progress_expired(page):
-            prev_name = page.name
-            thread = await page.get_thread()
-            await page.rename(f"deleted:{page.name}")
-            await page.set_tags({})
-            await thread.new_post(
-                title=config("posting.title"),
-                source=config("posting.phrases.too_long_in_progress")
-            )
-            logger.info(f"Статья в работе перенесена в архив удаленных: {prev_name} -> {page}")
+            new_name = await archive_page(page.name, source=config("posting.phrases.too_long_in_progress"))
+            logger.info(f"Статья в работе перенесена в архив удаленных: {page} -> {new_name}")
         else:
             if unwanted_tags.intersection(page.tags or []):
                 removed_tags = await page.remove_tags(unwanted_tags)
                 logger.info(f"Удалены теги полигона для статьи в работе: {page.name} {removed_tags}")
 
+    await bot.process(process, target_pages, Priority.Normal, skip_unchanged=True)
+
 
-@bot.task(period=extract_period(config("runtime.work_period")))
+@bot.task(period=extract_period(config("runtime.work_period")), min_period=MIN_WORK_PERIOD, max_period=MAX_WORK_PERIOD)
 async def untag_categories():
-    all_pages = await bot.list_pages(
-        category=" ".join(config("tags.untagging.categories")),
-        tags=" ".join(exclude_tags_or_category(config("tags.exclude_with")) + exclude_tags_or_category(config("tags.untagging.exclude_with")))
-    )
     no_tags_pages = await bot.list_pages(
         category=" ".join(config("tags.untagging.categories")),
         tags="-"
@@ -248,16 +371,15 @@ async def untag_categories():
     logger.info(f"{list(no_tags_pages)}")
 
     no_tags_page_ids = set([page.name for page in no_tags_pages])
-    target_pages = [page for page in all_pages if page.name not in no_tags_page_ids]
+    all_pages = bot.iter_pages(
+        category=" ".join(config("tags.untagging.categories")),
+        tags=" ".join(exclude_tags_or_category(config("tags.exclude_with")) + exclude_tags_or_category(config("tags.untagging.exclude_with")))
+    )
+    target_pages = (page async for page in all_pages if page.name not in no_tags_page_ids)
 
-    for page in target_pages:
+    async def process(page: Page):
         await page.fetch()
-        removed_tags = set(page.tags) - {config("tags.untagging.exclude_with")}
-        await page.remove_tags(removed_tags, lazy=False)
-
-        thread = await page.get_thread()
-        await thread.new_post(
-            title=config("posting.title"),
-            source=config("posting.phrases.tags_prohibited")
-        )
+        removed_tags = await untag_page(page.name, tags=list(set(page.tags) - {config("tags.untagging.exclude_with")}))
         logger.info(f"Со статьи {page.name} ({page.title}) удалены все теги: {removed_tags}")
+
+    await bot.process(process, target_pages, Priority.Low)
@@ -10,10 +10,14 @@ load_dotenv()
 CONFIG_PATH = "config.yml"
 
 API_TOKEN = getenv("CERBERUS_AUTHKEY")
+WORKER_ID = getenv("CERBERUS_WORKER")
 DEBUG = bool(loads(getenv("DEBUG", "false")))
 
-with open(CONFIG_PATH, "r", encoding="utf-8") as file:
-    _config = safe_load(file)
+def load_config(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as file:
+        return safe_load(file)
+
+_config = load_config(CONFIG_PATH)
 
 def extract_period(param) -> timedelta:
     return timedelta(
@@ -24,8 +28,11 @@ def extract_period(param) -> timedelta:
     )
 
 def config(param: str, default=None) -> Any:
+    return lookup(_config, param, default)
+
+def lookup(data: Any, param: str, default=None) -> Any:
     params = param.split(".")
-    current_layer = _config
+    current_layer = data
 
     for name in params:
         if name in current_layer:
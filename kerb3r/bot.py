@@ -1,14 +1,27 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
-from typing import Callable, List
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Any, Set, Tuple
+from contextlib import asynccontextmanager
+from contextvars import ContextVar, copy_context
 from datetime import timedelta
+from functools import partial
+from time import monotonic
 
 from .wiki import Wiki, Page, Endpoint, Route, Module
+from .sharding import Coordinator, PageClaimed
+from .deadlines import DeadlineQueue
+from .workqueue import WorkQueue, RateLimiter, Priority, _aiter
+from .profiling import Profiler
+from .journal import Journal, Operation, OperationAborted
+from .utils import now, fast_json_loads
 
 import asyncio
 import logging
 
+# Pages with reached deadlines the current task run is limited to
+_due_page_ids: ContextVar[Optional[Set[str]]] = ContextVar("due_page_ids", default=None)
+
 @dataclass
 class Task:
     action: Callable
@@ -17,6 +30,79 @@ class Task:
 @dataclass
 class PeriodicTask(Task):
     period: int
+    leader_only: bool = False
+    min_period: Optional[int] = None
+    max_period: Optional[int] = None
+    next_run: Optional[int] = 0
+    runs: int = 0
+    started_at: float = 0
+    previous_started_at: float = 0
+    changed: Set[str] = field(default_factory=set)
+    fingerprints: Dict[str, Tuple] = field(default_factory=dict)
+    observed: Dict[str, Tuple] = field(default_factory=dict)
+    # Pages of the current run whose handler failed or expired in queue
+    failed: Set[str] = field(default_factory=set)
+    due_pages: Set[str] = field(default_factory=set)
+    # Page id -> registry fingerprint at the moment the page was last processed
+    processed: Dict[str, Tuple] = field(default_factory=dict)
+
+    @property
+    def is_adaptive(self) -> bool:
+        return self.min_period is not None and self.max_period is not None
+
+    def observe(self, page_id: str, fingerprint: Tuple):
+        previous = self.fingerprints.get(page_id)
+        # Pages appeared since the last run are changes too, but not on the first run
+        if previous != fingerprint and (previous is not None or self.runs):
+            self.changed.add(page_id)
+        self.observed[page_id] = fingerprint
+
+    def keep_observed(self, page_id: str):
+        if page_id in self.fingerprints:
+            self.observed[page_id] = self.fingerprints[page_id]
+
+    def fail(self, page_id: str):
+        # Failed page is not known to be changed, so its previous fingerprint is kept
+        self.failed.add(page_id)
+        self.changed.discard(page_id)
+        self.keep_observed(page_id)
+
+    @property
+    def failure_rate(self) -> float:
+        total = len(self.fingerprints.keys() | self.observed.keys() | self.failed)
+        return len(self.failed) / total if total else 0
+
+    def adapt_period(self, duration: float, own_changes: Set[str], tighten_rate: float, relax_rate: float, backoff_rate: float=0.5) -> float:
+        """
+        Halves the period if the share of pages changed since the previous
+        run reaches `tighten_rate` and grows it by half if the share does
+        not exceed `relax_rate`. Pages in `own_changes` were changed by the
+        bot itself and are not counted. Failed pages are not counted either,
+        and the period grows by half if their share reaches `backoff_rate`,
+        so failing wiki is not polled more often. Period is kept at least
+        1.25 of run duration so runs do not follow each other back to back.
+
+        Returns the share of changed pages among the checked ones.
+        """
+        # Pages which left the listing (archived, deleted) are changes as well
+        changed = (self.changed | (self.fingerprints.keys() - self.observed.keys())) - own_changes - self.failed if self.runs else set()
+        checked = len(self.fingerprints.keys() | self.observed.keys() | self.failed) - len(self.failed)
+        rate = len(changed) / checked if checked else 0
+
+        period = self.period
+        if self.failure_rate >= backoff_rate:
+            period *= 1.5
+        elif rate >= tighten_rate:
+            period /= 2
+        elif rate <= relax_rate:
+            period *= 1.5
+        period = max(period, duration * 1.25)
+        self.period = int(min(self.max_period, max(self.min_period, period)))
+
+        self.fingerprints, self.observed = self.observed, {}
+        self.changed, self.failed = set(), set()
+        self.runs += 1
+        return rate
 
 class Bot:
     def __init__(self, wiki: Wiki):
@@ -24,9 +110,29 @@ class Bot:
         self._on_startup: List[Task] = []
         self._on_shutdown: List[Task] = []
         self._scheduled_tasks: List[PeriodicTask] = []
-        self._ev = asyncio.get_event_loop()
+        self._ev: Optional[asyncio.AbstractEventLoop] = None
+        self._uvloop = False
         self.is_running = False
         self._logger = logging.getLogger()
+        self._snapshot_path: Optional[str] = None
+        self._snapshot_max_idle: Optional[timedelta] = None
+        self._coordinator: Optional[Coordinator] = None
+        self.deadlines = DeadlineQueue()
+        self._deadline_tasks: Dict[str, str] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+        self.queue = WorkQueue()
+        self._profiler: Optional[Profiler] = None
+        self.journal = Journal()
+        self._actions: Dict[str, Callable] = {}
+        self._rechecks: Dict[str, Callable[[str], Awaitable[bool]]] = {}
+        # Page id -> amount of running actions holding its claim
+        self._claims: Dict[str, int] = {}
+        self._cycles = 0
+        self._tighten_rate = 0.05
+        self._relax_rate = 0.01
+        self._page_fingerprints_at: Optional[float] = None
+        self._page_fingerprints: Dict[str, Tuple] = {}
+        self._page_fingerprints_lock = asyncio.Lock()
 
     def run(self):
         if self.is_running:
@@ -35,8 +141,25 @@ class Bot:
         self._logger.debug("Running bot event loop")
         self.is_running = True
 
+        self._ev = self._new_event_loop()
+        asyncio.set_event_loop(self._ev)
+
+        if self._profiler:
+            self._profiler.install(self._ev)
+
+        if self._snapshot_path:
+            self.load_snapshot()
+
+        if self._coordinator:
+            if self.journal.path:
+                self._coordinator.register_journal(self.journal.path)
+            self._coordinator.heartbeat()
+            self._heartbeat = self._ev.create_task(self._coordinator_heartbeat())
+
         for task in self._on_startup:
             self._ev.create_task(task.action())
+        for operation in self.journal.pending():
+            self._ev.create_task(self._resume_action(operation))
         try:
             self._scheduler = self._ev.create_task(self._task_scheduler())
             self._ev.run_forever()
@@ -51,20 +174,384 @@ class Bot:
         self.is_running = False
 
         self._scheduler.cancel()
-        
+        self.queue.stop()
+
+        if self._profiler:
+            self._profiler.uninstall()
+
         for task in self._on_shutdown:
             self._ev.create_task(task.action())
+        if self._snapshot_path:
+            self.wiki.cache.dump(self._snapshot_path, self._snapshot_data())
+        self.journal.checkpoint()
+        self.journal.close()
+
+        if self._coordinator:
+            self._heartbeat.cancel()
+            # Journal is closed first, as the leader may take it over once the worker left.
+            # Executor threads are joined on exit, so leave is completed even after the loop stops
+            self._ev.run_in_executor(None, self._coordinator.leave)
         self._ev.create_task(self.wiki._close_api())
 
         self._ev.call_soon(self._ev.stop)
         if not self._ev.is_running():
             self._ev.run_forever()
 
+    def _new_event_loop(self) -> asyncio.AbstractEventLoop:
+        if self._uvloop:
+            try:
+                import uvloop
+                return uvloop.new_event_loop()
+            except ImportError:
+                self._logger.warning("uvloop is not installed, running on default asyncio event loop")
+        return asyncio.new_event_loop()
+
+    def runtime(self, uvloop: bool=False, fast_json: bool=False) -> Bot:
+        """
+        Enables optional faster runtime: uvloop event loop and orjson
+        decoding of API responses. Falls back to standard library ones
+        if the packages are not installed.
+        """
+        self._uvloop = uvloop
+        if fast_json:
+            loads = fast_json_loads()
+            if loads is None:
+                self._logger.warning("orjson is not installed, decoding API responses with json module")
+            else:
+                self.wiki.json_loads = loads
+        return self
+
     def auth(self, auth_token=None) -> Bot:
         if auth_token:
             self.wiki.token = auth_token
         return self
     
+    def snapshot(self, path: str, period: timedelta, ttl: timedelta=timedelta(), max_idle: Optional[timedelta]=None) -> Bot:
+        """
+        Persists wiki cache, deadlines and fingerprints of processed pages
+        to `path` every `period`. Cached data of pages not used for
+        `max_idle` is dropped before saving.
+        """
+        self._snapshot_path = path
+        self._snapshot_max_idle = max_idle
+        self.wiki.cache.ttl = ttl.total_seconds()
+        self._scheduled_tasks.append(
+            PeriodicTask(self.save_snapshot, "save_snapshot", int(period.total_seconds()))
+        )
+        return self
+
+    def work_queue(self, concurrency: int=1, requests_per_second: Optional[float]=None, max_pending: Optional[int]=None) -> Bot:
+        self.queue = WorkQueue(concurrency, max_pending)
+        self.wiki.limiter = RateLimiter(requests_per_second) if requests_per_second else None
+        return self
+
+    async def process(self, handler: Callable[[Any], Awaitable[Any]], items: Iterable[Any] | AsyncIterable[Any], priority: Priority=Priority.Normal, deadline: Optional[timedelta]=None, skip_unchanged: bool=False) -> int:
+        """
+        Handles items in the work queue on behalf of the current task.
+
+        If `skip_unchanged` is set, pages whose registry fingerprint did not
+        change since the task processed them last time are skipped. It is
+        only correct for tasks whose time-based transitions are tracked by
+        deadlines, as such pages are handled once the deadline is reached.
+
+        Items which waited in the queue longer than `deadline`, by default
+        the current period of the task, are dropped.
+        """
+        task = asyncio.current_task()
+        task_name = task.get_name() if task else "default"
+
+        due_page_ids = _due_page_ids.get()
+        scheduled_task = self._get_task(task_name)
+        skip_unchanged = skip_unchanged and scheduled_task is not None
+        listed: Set[str] = set()
+
+        if skip_unchanged:
+            fingerprints = await self._get_page_fingerprints(scheduled_task.min_period or scheduled_task.period)
+            handler = self._recording(handler, scheduled_task, fingerprints)
+
+        if due_page_ids is not None:
+            items = self._only_due(items, due_page_ids)
+        else:
+            if skip_unchanged:
+                items = self._only_changed(items, scheduled_task, fingerprints, listed)
+            if scheduled_task is not None and scheduled_task.is_adaptive:
+                waiting: Set[str] = set()
+                items = self._waiting(items, waiting)
+                handler = self._observing(handler, scheduled_task, waiting)
+
+        if deadline is None and scheduled_task is not None:
+            deadline = timedelta(seconds=scheduled_task.period)
+
+        processed = await self.queue.map(handler, items, priority, task_name, deadline.total_seconds() if deadline else None)
+
+        if due_page_ids is None and scheduled_task is not None and scheduled_task.is_adaptive:
+            # Pages left waiting expired in the queue
+            for page_id in waiting:
+                scheduled_task.fail(page_id)
+
+        if skip_unchanged and due_page_ids is None:
+            # Forget pages which left the listing
+            scheduled_task.processed = {page_id: fingerprint for page_id, fingerprint in scheduled_task.processed.items() if page_id in listed}
+        self._logger.debug(f"Work queue after {task_name} ({processed} items): depth {self.queue.depth}, {self.queue.stats().get(task_name)}")
+        return processed
+
+    async def _only_due(self, items: Iterable[Any] | AsyncIterable[Any], due_page_ids: Set[str]) -> AsyncIterator[Any]:
+        # Listing is still requested, so pages which no longer match it are not touched
+        async for item in _aiter(items):
+            if not isinstance(item, Page) or item.name in due_page_ids:
+                yield item
+
+    async def _only_changed(self, items: Iterable[Any] | AsyncIterable[Any], task: PeriodicTask, fingerprints: Dict[str, Tuple], listed: Set[str]) -> AsyncIterator[Any]:
+        skipped = 0
+        async for item in _aiter(items):
+            if isinstance(item, Page):
+                listed.add(item.name)
+                fingerprint = fingerprints.get(item.name)
+                if fingerprint is not None and task.processed.get(item.name) == fingerprint:
+                    task.keep_observed(item.name)
+                    skipped += 1
+                    continue
+            yield item
+
+        self._logger.debug(f"Task {task.name} skipped {skipped} unchanged pages")
+
+    def _recording(self, handler: Callable[[Any], Awaitable[Any]], task: PeriodicTask, fingerprints: Dict[str, Tuple]) -> Callable[[Any], Awaitable[Any]]:
+        async def wrapper(item: Any) -> Any:
+            page_id = item.name if isinstance(item, Page) else None
+            result = await handler(item)
+            if page_id in fingerprints:
+                task.processed[page_id] = fingerprints[page_id]
+            return result
+
+        return wrapper
+
+    async def _get_page_fingerprints(self, ttl: float) -> Dict[str, Tuple]:
+        """
+        Returns registry fingerprints of all pages, reusing the ones fetched
+        less than `ttl` seconds ago. Page changed in the meantime is skipped
+        at most until the fingerprints are refetched.
+        """
+        async with self._page_fingerprints_lock:
+            if self._page_fingerprints_at is None or monotonic() - self._page_fingerprints_at >= ttl:
+                try:
+                    self._page_fingerprints = await self.wiki.get_page_fingerprints()
+                except Exception as e:
+                    self._logger.warning(f"Failed to get page fingerprints, unchanged pages are not skipped: {e}")
+                    return {}
+                self._page_fingerprints_at = monotonic()
+        return self._page_fingerprints
+
+    async def _waiting(self, items: Iterable[Any] | AsyncIterable[Any], waiting: Set[str]) -> AsyncIterator[Any]:
+        async for item in _aiter(items):
+            if isinstance(item, Page):
+                waiting.add(item.name)
+            yield item
+
+    def _observing(self, handler: Callable[[Any], Awaitable[Any]], task: PeriodicTask, waiting: Set[str]) -> Callable[[Any], Awaitable[Any]]:
+        async def wrapper(item: Any) -> Any:
+            # Handler may rename the page, so its id is taken in advance
+            page_id = item.name if isinstance(item, Page) else None
+            waiting.discard(page_id)
+            try:
+                result = await handler(item)
+            except BaseException:
+                if page_id is not None:
+                    task.fail(page_id)
+                raise
+            if page_id is not None:
+                fingerprint = (item.revision, item.votes_count, item.rating)
+                if fingerprint != (None, None, None):
+                    task.observe(page_id, fingerprint)
+            return result
+
+        return wrapper
+
+    def adaptive_periods(self, tighten_rate: float, relax_rate: float) -> Bot:
+        """
+        Sets shares of pages changed since the previous run, at which
+        periods of adaptive tasks are shortened or extended.
+        """
+        if relax_rate > tighten_rate:
+            raise ValueError("Relax rate of adaptive periods must not exceed tighten rate.")
+
+        self._tighten_rate = tighten_rate
+        self._relax_rate = relax_rate
+        return self
+
+    def task_periods(self) -> Dict[str, int]:
+        return {task.name: task.period for task in self._scheduled_tasks}
+
+    def profiling(self, profiler: Profiler) -> Bot:
+        self._profiler = profiler
+        self._profiler.info = lambda: {
+            "Running tasks": [name for name, task in self._running.items() if not task.done()],
+            "Task periods": self.task_periods(),
+            "Work queue depth": self.queue.depth,
+            "Work queue stats": self.queue.stats(),
+            "Response cache": self.wiki.responses.stats() if self.wiki.responses else None,
+        }
+        return self
+
+    def action_journal(self, journal: Journal, checkpoint_period: timedelta) -> Bot:
+        self.journal = journal
+        self._scheduled_tasks.append(
+            PeriodicTask(self.checkpoint_journal, "checkpoint_journal", int(checkpoint_period.total_seconds()))
+        )
+        return self
+
+    async def checkpoint_journal(self):
+        self.journal.checkpoint()
+        self._logger.debug(f"Journal checkpoint: {len(self.journal.pending())} pending operations")
+
+    def action(self, complete: bool=True, recheck: Optional[Callable[[str], Awaitable[bool]]]=None, leader_only: bool=False):
+        """
+        Registers journaled multistep action. Decorated function receives
+        `Operation` followed by the call arguments, which must be JSON
+        serializable. Actions interrupted by crash are resumed on startup.
+        If `complete` is false, operation stays pending after the action
+        and has to be completed by the caller.
+
+        `recheck` receives page id of resumed action and tells whether its
+        remaining steps should still be applied, otherwise the action is
+        dropped. It is called before the first step not applied yet.
+
+        With sharding the page is claimed for the time of the action, and
+        `PageClaimed` is raised if the worker does not own the page, or is
+        not the leader for `leader_only` action. Pending action is finished
+        by the worker which started it regardless of ownership.
+        """
+        def decorator(func):
+            async def wrapper(page_id: str, **kwargs):
+                key = f"{func.__name__}:{page_id}"
+                resumed = any(operation.key == key for operation in self.journal.pending(func.__name__))
+                async with self._claim(page_id, leader_only, any_owner=resumed):
+                    operation = self.journal.begin(func.__name__, key, page_id=page_id, **kwargs)
+                    async with operation.lock:
+                        try:
+                            result = await func(operation, **operation.args)
+                        except OperationAborted:
+                            self._logger.info(f"Action {operation} is no longer needed, dropping it")
+                            operation.complete()
+                            return None
+                        if complete:
+                            operation.complete()
+                return result
+
+            self._actions[func.__name__] = wrapper
+            if recheck is not None:
+                self._rechecks[func.__name__] = recheck
+            self._logger.debug(f"Added new journaled action {func.__name__}")
+
+            return wrapper
+        return decorator
+
+    async def _resume_action(self, operation: Operation):
+        action = self._actions.get(operation.kind)
+        if action is None:
+            self._logger.warning(f"Unknown journaled action {operation.kind}, skipping {operation}")
+            return
+
+        recheck = self._rechecks.get(operation.kind)
+        if recheck is not None:
+            operation.recheck = partial(recheck, operation.args["page_id"])
+
+        self._logger.info(f"Resuming interrupted action {operation}")
+        while True:
+            try:
+                await action(**operation.args)
+            except PageClaimed:
+                # Another worker changes the page now, its claim is released or expires
+                await asyncio.sleep(self._coordinator.lease / 3)
+                continue
+            except Exception as e:
+                self._logger.error(f"Failed to resume action {operation}: {e}")
+            return
+
+    def shard(self, coordinator: Coordinator) -> Bot:
+        self._coordinator = coordinator
+        return self
+
+    @asynccontextmanager
+    async def _claim(self, page_id: str, leader_only: bool=False, any_owner: bool=False) -> AsyncIterator[None]:
+        if self._coordinator is None:
+            yield
+            return
+
+        # Claim of the page is shared by concurrent actions of this worker
+        if not self._claims.get(page_id):
+            if not await self._ev.run_in_executor(None, self._coordinator.claim, page_id, leader_only, any_owner):
+                raise PageClaimed(page_id)
+        self._claims[page_id] = self._claims.get(page_id, 0) + 1
+
+        try:
+            yield
+        finally:
+            self._claims[page_id] -= 1
+            if not self._claims[page_id]:
+                del self._claims[page_id]
+                await self._ev.run_in_executor(None, self._coordinator.release, page_id)
+
+    @property
+    def is_leader(self) -> bool:
+        return self._coordinator is None or self._coordinator.is_leader
+
+    def owns(self, page: Page | str) -> bool:
+        if self._coordinator is None:
+            return True
+        return self._coordinator.owns(page.name if isinstance(page, Page) else page)
+
+    async def _coordinator_heartbeat(self):
+        while True:
+            await asyncio.sleep(self._coordinator.lease / 3)
+            try:
+                # SQLite calls may block up to the lock timeout on contended database
+                await self._ev.run_in_executor(None, self._coordinator.heartbeat)
+            except Exception as e:
+                self._logger.error(f"Worker heartbeat failed: {e}")
+
+            for path in self._coordinator.take_orphaned_journals():
+                try:
+                    adopted = self.journal.adopt(path)
+                except Exception as e:
+                    self._logger.error(f"Failed to take over journal {path}: {e}")
+                    continue
+                self._logger.info(f"Took over {len(adopted)} pending operations from journal {path}")
+                for operation in adopted:
+                    self._ev.create_task(self._resume_action(operation))
+
+    def load_snapshot(self):
+        if not self._snapshot_path:
+            return
+
+        data = self.wiki.cache.load(self._snapshot_path)
+        self.deadlines.load_dict(data.get("deadlines", []))
+        for task_name, processed in data.get("processed", {}).items():
+            task = self._get_task(task_name)
+            if task is not None:
+                # JSON turns fingerprint tuples into lists
+                task.processed = {page_id: tuple(tuple(value) if isinstance(value, list) else value for value in fingerprint) for page_id, fingerprint in processed.items()}
+        self._logger.debug(f"Loaded snapshot {self._snapshot_path}: {len(self.wiki.cache.article_logs)} article logs, {len(self.wiki.cache.thread_ids)} threads, {len(self.deadlines)} deadlines")
+
+    def _snapshot_data(self) -> Dict[str, Any]:
+        data = self.wiki.cache.to_dict()
+        data["deadlines"] = self.deadlines.to_dict()
+        # Pages processed before restart are skipped by the first run while unchanged
+        data["processed"] = {task.name: dict(task.processed) for task in self._scheduled_tasks if task.processed}
+        return data
+
+    async def save_snapshot(self):
+        if not self._snapshot_path:
+            return
+
+        if self._snapshot_max_idle:
+            pruned = self.wiki.cache.prune(self._snapshot_max_idle.total_seconds())
+            if pruned:
+                self._logger.debug(f"Dropped cached data of {pruned} idle pages")
+
+        data = self._snapshot_data()
+        await self._ev.run_in_executor(None, self.wiki.cache.dump, self._snapshot_path, data)
+        self._logger.debug(f"Saved snapshot {self._snapshot_path}")
+
     def on_startup(self):
         def decorator(func):
             async def wrapper():
@@ -87,33 +574,113 @@ class Bot:
             return wrapper
         return decorator
 
-    def task(self, period: timedelta):
-        if period.total_seconds() < 1:
+    def task(self, period: timedelta, leader_only: bool=False, deadlines: Optional[List[str]]=None, min_period: Optional[timedelta]=None, max_period: Optional[timedelta]=None):
+        """
+        Registers periodic task. If `min_period` and `max_period` are set,
+        the period adapts to the rate of changes of pages processed by the
+        task through `process`, starting from `period`.
+        """
+        if period.total_seconds() < 1 or (min_period is not None and min_period.total_seconds() < 1):
             raise ValueError("Task period must be at least one second.")
+        if (min_period is None) != (max_period is None):
+            raise ValueError("Both min and max period of adaptive task must be set.")
 
         def decorator(func):
             async def wrapper():
                 return await func()
             
             self._scheduled_tasks.append(
-                PeriodicTask(wrapper, func.__name__, int(period.total_seconds()))
+                PeriodicTask(
+                    wrapper,
+                    func.__name__,
+                    int(period.total_seconds()),
+                    leader_only,
+                    int(min_period.total_seconds()) if min_period else None,
+                    int(max_period.total_seconds()) if max_period else None
+                )
             )
+            for kind in deadlines or []:
+                self._deadline_tasks[kind] = func.__name__
             self._logger.debug(f"Added new periodic task {func.__name__}")
 
             return wrapper
         return decorator
     
-    async def _task_scheduler(self):
-        cycles = 0
+    def _start_task(self, task: PeriodicTask, due_page_ids: Optional[Set[str]]=None):
+        """
+        Starts regular run of the task or, if `due_page_ids` are given, run
+        limited to the pages with reached deadlines.
+        """
+        if task.leader_only and not self.is_leader:
+            self._logger.debug(f"Skipping leader only task {task.name}")
+            if due_page_ids is None and task.is_adaptive and task.next_run is not None:
+                task.next_run = self._cycles + task.period
+            return
 
+        context = copy_context()
+        context.run(_due_page_ids.set, due_page_ids)
+        running = self._ev.create_task(task.action(), name=task.name, context=context)
+        self._running[task.name] = running
+
+        if due_page_ids is not None:
+            self._logger.debug(f"Running task {task.name} for {len(due_page_ids)} pages with reached deadlines")
+            return
+        self._logger.debug(f"Running periodic task {task.name}")
+
+        if task.is_adaptive:
+            # Next run of adaptive task is planned when the current one finishes
+            task.next_run = None
+            task.previous_started_at, task.started_at = task.started_at, monotonic()
+            running.add_done_callback(partial(self._on_adaptive_task_done, task))
+
+    def _on_adaptive_task_done(self, task: PeriodicTask, running: asyncio.Task):
+        duration = monotonic() - task.started_at
+        if running.cancelled() or running.exception() is not None:
+            task.observed, task.changed, task.failed = {}, set(), set()
+            task.started_at = task.previous_started_at
+        else:
+            # Changes made by the bot since the previous run started are its own
+            own_changes = {page_id for page_id, written_at in self.wiki.written_at.items() if written_at >= task.previous_started_at}
+            previous_period, failure_rate = task.period, task.failure_rate
+            rate = task.adapt_period(duration, own_changes, self._tighten_rate, self._relax_rate)
+            log = self._logger.info if task.period != previous_period else self._logger.debug
+            log(f"Task {task.name} period: {previous_period}s -> {task.period}s ({rate:.1%} pages changed, {failure_rate:.1%} failed, run took {duration:.1f}s)")
+
+            oldest_run = min(adaptive.previous_started_at for adaptive in self._scheduled_tasks if adaptive.is_adaptive)
+            self.wiki.forget_writes(oldest_run)
+
+        task.next_run = self._cycles + task.period
+
+    def _get_task(self, name: str) -> Optional[PeriodicTask]:
+        return next((task for task in self._scheduled_tasks if task.name == name), None)
+
+    def _is_task_running(self, task: PeriodicTask) -> bool:
+        running = self._running.get(task.name)
+        return running is not None and not running.done()
+
+    async def _task_scheduler(self):
         while True:
+            for deadline in self.deadlines.pop_due(now()):
+                task = self._get_task(self._deadline_tasks.get(deadline.kind))
+                if task is not None:
+                    task.due_pages.add(deadline.page_id)
+
             for task in self._scheduled_tasks:
-                if cycles % task.period == 0:
-                    self._ev.create_task(task.action())
-                    self._logger.debug(f"Running periodic task {task.name}")
+                if task.next_run is not None and self._cycles >= task.next_run:
+                    if not task.is_adaptive:
+                        task.next_run = self._cycles + task.period
+                    # Regular run lists all pages, including the ones with reached deadlines
+                    for page_id in task.due_pages:
+                        task.processed.pop(page_id, None)
+                    task.due_pages.clear()
+                    self._start_task(task)
+                elif task.due_pages and not self._is_task_running(task):
+                    # Pages with deadlines reached during the previous run wait until it finishes
+                    due_page_ids, task.due_pages = task.due_pages, set()
+                    self._start_task(task, due_page_ids)
 
             await asyncio.sleep(1)
-            cycles += 1
+            self._cycles += 1
     
     async def get_page(self, page_id: str, lazy: bool=True) -> Page:
         return await self.wiki.get_page(page_id, lazy)
@@ -125,7 +692,16 @@ class Bot:
         return await self.wiki.module(module, method, **kwargs)
     
     async def list_pages(self, **params) -> List[Page]:
-        return await self.wiki.list_pages(**params)
+        return [page for page in await self.wiki.list_pages(**params) if self.owns(page)]
+    
+    async def iter_pages(self, all_shards: bool=False, **params) -> AsyncIterator[Page]:
+        """
+        Lists pages owned by this worker, or pages of all workers if
+        `all_shards` is set, which is meant for leader only tasks.
+        """
+        async for page in self.wiki.iter_pages(**params):
+            if all_shards or self.owns(page):
+                yield page
     
     async def get_all_pages(self) -> List[Page]:
         return await self.wiki.get_all_pages()
\ No newline at end of file
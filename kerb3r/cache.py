@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+from typing import Dict, Any, Hashable, Optional, Tuple
+from collections import OrderedDict
+from time import monotonic, time
+
+import gzip
+import json
+import os
+import logging
+
+SNAPSHOT_VERSION = 1
+
+
+class WikiCache:
+    """
+    Cache of wiki data which is expensive to refetch: forum thread ids and
+    full article logs. Can be dumped to and loaded from a compact snapshot
+    file so restarted bot does not have to cold-fetch everything.
+
+    Article log is append-only, so cached log stays valid as long as
+    revisions count of the article did not change. Logs are considered
+    fresh for `ttl` seconds after last revalidation, logs loaded from
+    snapshot are stale until revalidated on the next use.
+
+    Entries of pages which were not used for a while are removed by `prune`,
+    so pages which left all listings do not stay in the cache forever.
+    """
+
+    def __init__(self, ttl: float=0):
+        self.ttl = ttl
+        self.thread_ids: Dict[str, Any] = {}
+        self.article_logs: Dict[str, Any] = {}
+        self._validated_at: Dict[str, float] = {}
+        # Page id -> unix time of the last use, kept in snapshot
+        self._used_at: Dict[str, float] = {}
+        self._logger = logging.getLogger()
+
+    def _use(self, page_id: str):
+        self._used_at[page_id] = time()
+
+    def get_thread_id(self, page_id: str) -> Any:
+        thread_id = self.thread_ids.get(page_id)
+        if thread_id is not None:
+            self._use(page_id)
+        return thread_id
+
+    def set_thread_id(self, page_id: str, thread_id: Any):
+        self.thread_ids[page_id] = thread_id
+        self._use(page_id)
+
+    def has_article_log(self, page_id: str) -> bool:
+        return page_id in self.article_logs
+
+    def is_fresh(self, page_id: str) -> bool:
+        validated_at = self._validated_at.get(page_id)
+        return validated_at is not None and monotonic() - validated_at < self.ttl
+
+    def get_article_log(self, page_id: str) -> Any:
+        if not self.is_fresh(page_id):
+            return None
+        self._use(page_id)
+        return self.article_logs.get(page_id)
+
+    def revalidate_article_log(self, page_id: str, count: int) -> Any:
+        log = self.article_logs.get(page_id)
+        if log is None:
+            return None
+        if log["count"] != count:
+            self.invalidate_article_log(page_id)
+            return None
+        self._validated_at[page_id] = monotonic()
+        self._use(page_id)
+        return log
+
+    def set_article_log(self, page_id: str, log: Any):
+        self.article_logs[page_id] = log
+        self._validated_at[page_id] = monotonic()
+        self._use(page_id)
+
+    def invalidate_article_log(self, page_id: str):
+        self.article_logs.pop(page_id, None)
+        self._validated_at.pop(page_id, None)
+
+    def drop(self, page_id: str):
+        self.invalidate_article_log(page_id)
+        self.thread_ids.pop(page_id, None)
+        self._used_at.pop(page_id, None)
+
+    def rename(self, old_id: str, new_id: str):
+        if old_id in self.thread_ids:
+            self.thread_ids[new_id] = self.thread_ids.pop(old_id)
+            self._use(new_id)
+        self.invalidate_article_log(old_id)
+        self._used_at.pop(old_id, None)
+
+    def prune(self, max_idle: float) -> int:
+        """
+        Drops entries of pages which were not used for `max_idle` seconds.
+        Returns amount of dropped pages.
+        """
+        moment = time()
+        idle = [
+            page_id for page_id in self.thread_ids.keys() | self.article_logs.keys()
+            # Entries without use time, e.g. from older snapshot, count as used now
+            if moment - self._used_at.setdefault(page_id, moment) >= max_idle
+        ]
+        for page_id in idle:
+            self.drop(page_id)
+        return len(idle)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "thread_ids": dict(self.thread_ids),
+            "article_logs": dict(self.article_logs),
+            "used_at": dict(self._used_at),
+        }
+
+    def load_dict(self, data: Dict[str, Any]):
+        if data.get("version") != SNAPSHOT_VERSION:
+            self._logger.warning(f"Unsupported snapshot version {data.get("version")}, ignoring")
+            return
+
+        self.thread_ids.update(data.get("thread_ids", {}))
+        self.article_logs.update(data.get("article_logs", {}))
+        self._used_at.update(data.get("used_at", {}))
+
+    @staticmethod
+    def dump(path: str, data: Dict[str, Any]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            json.dump(data, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> Dict[str, Any]:
+        if not os.path.exists(path):
+            return {}
+
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            self._logger.warning(f"Failed to load snapshot {path}: {e}")
+            return {}
+
+        self.load_dict(data)
+        return data
+
+
+class ResponseCache:
+    """
+    LRU cache of HTTP response bodies together with their validators
+    (ETag / Last-Modified) used for conditional requests.
+
+    Bounded both by amount of entries and by total size of bodies.
+    """
+
+    def __init__(self, max_entries: int=1024, max_bytes: int=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, Tuple[Optional[str], Optional[str], bytes]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(method: str, endpoint: str, params: Any=None) -> Hashable:
+        if isinstance(params, dict):
+            params = tuple(sorted((str(k), str(v)) for k, v in params.items()))
+        return (method, endpoint, params)
+
+    def validators(self, key: Hashable) -> Tuple[Dict[str, str], Optional[bytes]]:
+        """
+        Returns headers of conditional request together with the cached body
+        they validate. Caller keeps the body while the request is in flight,
+        as concurrent requests may evict the entry in the meantime.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return {}, None
+
+        etag, last_modified, body = entry
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        return headers, body
+
+    def hit(self, key: Hashable, body: bytes) -> bytes:
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def store(self, key: Hashable, etag: Optional[str], last_modified: Optional[str], body: bytes):
+        self.misses += 1
+        self.discard(key)
+
+        if not etag and not last_modified or len(body) > self.max_bytes:
+            return
+
+        self._entries[key] = (etag, last_modified, body)
+        self.size += len(body)
+
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            _, (_, _, evicted_body) = self._entries.popitem(last=False)
+            self.size -= len(evicted_body)
+
+    def discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
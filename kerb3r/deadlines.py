@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from typing import Dict, Tuple, List, Any, Optional
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import heapq
+
+
+@dataclass(order=True)
+class Deadline:
+    at: datetime
+    page_id: str = field(compare=False)
+    kind: str = field(compare=False)
+    fingerprint: Any = field(compare=False, default=None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"at": self.at.isoformat(), "page_id": self.page_id, "kind": self.kind, "fingerprint": self.fingerprint}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Deadline:
+        return cls(datetime.fromisoformat(data["at"]), data["page_id"], data["kind"], data["fingerprint"])
+
+
+class DeadlineQueue:
+    """
+    Priority queue of per-page deadlines of time-based transitions.
+
+    Deadline is bound to page fingerprint it was computed for, so it is
+    dropped as soon as the page changes and has to be recomputed.
+    """
+
+    def __init__(self):
+        self._heap: List[Deadline] = []
+        self._index: Dict[Tuple[str, str], Deadline] = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def set(self, page_id: str, kind: str, at: datetime, fingerprint: Any=None) -> Deadline:
+        deadline = Deadline(at, page_id, kind, fingerprint)
+        self._index[(page_id, kind)] = deadline
+        heapq.heappush(self._heap, deadline)
+        return deadline
+
+    def get(self, page_id: str, kind: str, fingerprint: Any=None) -> Optional[datetime]:
+        deadline = self._index.get((page_id, kind))
+        if deadline is None:
+            return None
+        if deadline.fingerprint != fingerprint:
+            self.discard(page_id, kind)
+            return None
+        return deadline.at
+
+    def discard(self, page_id: str, kind: Optional[str]=None):
+        if kind is not None:
+            self._index.pop((page_id, kind), None)
+            return
+
+        for key in [key for key in self._index if key[0] == page_id]:
+            del self._index[key]
+
+    def _is_actual(self, deadline: Deadline) -> bool:
+        return self._index.get((deadline.page_id, deadline.kind)) is deadline
+
+    def next_at(self) -> Optional[datetime]:
+        while self._heap and not self._is_actual(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0].at if self._heap else None
+
+    def pop_due(self, moment: datetime) -> List[Deadline]:
+        due = []
+        while self._heap and self._heap[0].at <= moment:
+            deadline = heapq.heappop(self._heap)
+            if self._is_actual(deadline):
+                del self._index[(deadline.page_id, deadline.kind)]
+                due.append(deadline)
+        return due
+
+    def to_dict(self) -> List[Dict[str, Any]]:
+        return [deadline.to_dict() for deadline in self._index.values()]
+
+    def load_dict(self, data: List[Dict[str, Any]]):
+        for deadline_data in data:
+            deadline = Deadline.from_dict(deadline_data)
+            self._index[(deadline.page_id, deadline.kind)] = deadline
+            self._heap.append(deadline)
+        heapq.heapify(self._heap)
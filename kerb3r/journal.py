@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, TextIO
+
+import os
+import json
+import asyncio
+import logging
+
+
+class OperationAborted(Exception):
+    pass
+
+
+class Operation:
+    """
+    Multistep wiki action recorded in the journal. Every step is applied
+    at most once: result of already applied step is taken from the journal.
+
+    Steps with `check` are not idempotent, so they are journaled as planned
+    before being applied. If the bot stopped between applying such step and
+    journaling its result, `check` finds out whether the step was applied
+    and returns its result, or None if the step has to be applied again.
+    Step which failed with an exception is unplanned, so it is applied
+    again on retry without asking `check`. Cancelled step stays planned,
+    as its request may have been sent already.
+
+    If `recheck` is set, it is awaited before the first step which is not
+    applied yet, and the operation is aborted if it returns false.
+    """
+
+    def __init__(self, journal: Journal, key: str, kind: str, args: Dict[str, Any], steps: Optional[Dict[str, Any]]=None):
+        self.journal = journal
+        self.key = key
+        self.kind = kind
+        self.args = args
+        self.steps: Dict[str, Any] = steps or {}
+        self.planned: Set[str] = set()
+        self.recheck: Optional[Callable[[], Awaitable[bool]]] = None
+        # Guards against running the same operation twice concurrently
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"{self.key} (steps done: {list(self.steps)})"
+
+    def is_done(self, step: str) -> bool:
+        return step in self.steps
+
+    async def step(self, name: str, action: Callable[[], Awaitable[Any]], sync: bool=False, check: Optional[Callable[[], Awaitable[Any]]]=None) -> Any:
+        if name in self.steps:
+            return self.steps[name]
+
+        if self.recheck is not None:
+            recheck, self.recheck = self.recheck, None
+            if not await recheck():
+                raise OperationAborted(self.key)
+
+        if check is not None:
+            if name in self.planned:
+                result = await check()
+                if result is not None:
+                    self.journal._logger.info(f"Planned step {name} of {self.key} was already applied")
+                    self._record(name, result, sync)
+                    return result
+            else:
+                self.planned.add(name)
+                self.journal._write({"op": self.key, "kind": self.kind, "args": self.args, "planned": name}, sync=True)
+
+        try:
+            result = await action()
+        except Exception:
+            if name in self.planned:
+                self.planned.discard(name)
+                self.journal._write({"op": self.key, "kind": self.kind, "args": self.args, "unplanned": name}, sync=True)
+            raise
+
+        self._record(name, result, sync)
+        return result
+
+    def _record(self, name: str, result: Any, sync: bool):
+        self.steps[name] = result
+        self.planned.discard(name)
+        self.journal._write({"op": self.key, "kind": self.kind, "args": self.args, "step": name, "result": result}, sync)
+
+    def complete(self):
+        self.journal._complete(self)
+
+
+class Journal:
+    """
+    Write-ahead journal of planned and applied wiki actions stored as JSON
+    lines. Operations which were not completed before the bot stopped are
+    loaded back as pending, so they can be resumed without repeating
+    applied steps.
+
+    Records are fsynced in batches of `fsync_batch`, except planned steps
+    and steps written with `sync=True`. Without path journal is kept in memory only.
+    """
+
+    def __init__(self, path: Optional[str]=None, fsync_batch: int=32):
+        self.path = path
+        self.fsync_batch = fsync_batch
+        self._operations: Dict[str, Operation] = {}
+        self._file: Optional[TextIO] = None
+        self._unsynced = 0
+        self._logger = logging.getLogger()
+
+        if path:
+            self._load()
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Last record may be torn by crash
+                    self._logger.warning(f"Skipping broken journal record: {line!r}")
+                    continue
+
+                if record.get("complete"):
+                    self._operations.pop(record["op"], None)
+                    continue
+
+                operation = self._operations.setdefault(record["op"], Operation(self, record["op"], record["kind"], record["args"]))
+                if "step" in record:
+                    operation.steps[record["step"]] = record["result"]
+                    operation.planned.discard(record["step"])
+                elif "planned" in record:
+                    operation.planned.add(record["planned"])
+                elif "unplanned" in record:
+                    operation.planned.discard(record["unplanned"])
+
+        if self._operations:
+            self._logger.info(f"Loaded {len(self._operations)} pending operations from journal {self.path}")
+
+    def _write(self, record: Dict[str, Any], sync: bool=False):
+        if self._file is None:
+            return
+
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._unsynced += 1
+        if sync or self._unsynced >= self.fsync_batch:
+            self.flush()
+
+    def flush(self):
+        if self._file is None or not self._unsynced:
+            return
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def begin(self, kind: str, key: str, **args) -> Operation:
+        operation = self._operations.get(key)
+        if operation is not None:
+            return operation
+
+        operation = Operation(self, key, kind, args)
+        self._operations[key] = operation
+        self._write({"op": key, "kind": kind, "args": args})
+        return operation
+
+    def _complete(self, operation: Operation):
+        if self._operations.pop(operation.key, None) is not None:
+            self._write({"op": operation.key, "complete": True})
+
+    def pending(self, kind: Optional[str]=None) -> List[Operation]:
+        return [operation for operation in self._operations.values() if kind is None or operation.kind == kind]
+
+    def checkpoint(self):
+        """
+        Compacts journal leaving only pending operations in it.
+        """
+        if self._file is None:
+            return
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for operation in self._operations.values():
+                for record in self._records(operation):
+                    file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._unsynced = 0
+
+    @staticmethod
+    def _records(operation: Operation) -> Iterator[Dict[str, Any]]:
+        yield {"op": operation.key, "kind": operation.kind, "args": operation.args}
+        for step, result in operation.steps.items():
+            yield {"op": operation.key, "kind": operation.kind, "args": operation.args, "step": step, "result": result}
+        for step in operation.planned:
+            yield {"op": operation.key, "kind": operation.kind, "args": operation.args, "planned": step}
+
+    def adopt(self, path: str) -> List[Operation]:
+        """
+        Takes over pending operations of journal at `path`, e.g. of a worker
+        which died, and removes that journal. Returns adopted operations.
+        """
+        orphan = Journal(path)
+        adopted = []
+        for operation in orphan.pending():
+            if operation.key in self._operations:
+                self._logger.warning(f"Operation {operation} of journal {path} is pending here too, keeping the local one")
+                continue
+
+            own = Operation(self, operation.key, operation.kind, operation.args, dict(operation.steps))
+            own.planned = set(operation.planned)
+            self._operations[own.key] = own
+            for record in self._records(own):
+                self._write(record)
+            adopted.append(own)
+
+        # Adopted operations are synced before the orphaned journal is gone
+        self.flush()
+        orphan.close()
+        os.remove(path)
+        return adopted
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self.flush()
+        self._file.close()
+        self._file = None
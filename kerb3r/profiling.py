@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from typing import Callable, Dict, Optional
+from collections import Counter
+from datetime import datetime
+from types import FrameType
+from time import monotonic, sleep
+
+import os
+import sys
+import signal
+import asyncio
+import logging
+import threading
+import traceback
+
+
+def _frame_key(frame: FrameType) -> str:
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}:{frame.f_lineno}"
+
+
+def _collapse_stack(frame: Optional[FrameType]) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_key(frame))
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class Profiler:
+    """
+    Diagnostics of the bot event loop which can be used in production.
+
+    * Slow callbacks: watchdog thread warns with the loop thread stack when
+      the loop did not respond for longer than `slow_callback` seconds.
+    * SIGUSR1: samples loop thread stacks for `sample_duration` seconds and
+      writes them in collapsed (flamegraph) format to `output_dir`.
+    * SIGUSR2: writes stacks of all pending asyncio tasks to `output_dir`,
+      prepended with the result of `info` callback.
+    """
+
+    def __init__(self, output_dir: str, slow_callback: Optional[float]=None, sample_duration: float=30, sample_interval: float=0.005):
+        self.output_dir = output_dir
+        self.slow_callback = slow_callback
+        self.sample_duration = sample_duration
+        self.sample_interval = sample_interval
+        self.info: Optional[Callable[[], Dict[str, object]]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = monotonic()
+        self._is_running = False
+        self._is_sampling = False
+        self._logger = logging.getLogger()
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._is_running = True
+
+        if self.slow_callback:
+            loop.call_soon(self._beat)
+            threading.Thread(target=self._watchdog, name="profiler-watchdog", daemon=True).start()
+
+        for signum, handler in ((getattr(signal, "SIGUSR1", None), self.start_sampling), (getattr(signal, "SIGUSR2", None), self.dump_tasks)):
+            if signum is None:
+                continue
+            try:
+                loop.add_signal_handler(signum, handler)
+            except (NotImplementedError, RuntimeError):
+                self._logger.debug(f"Profiler signal {signum} is not supported on this platform")
+
+    def uninstall(self):
+        self._is_running = False
+        if self._loop is None:
+            return
+
+        for signum in (getattr(signal, "SIGUSR1", None), getattr(signal, "SIGUSR2", None)):
+            if signum is not None:
+                try:
+                    self._loop.remove_signal_handler(signum)
+                except (NotImplementedError, RuntimeError):
+                    pass
+
+    def _output_path(self, kind: str) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        return os.path.join(self.output_dir, f"{kind}-{datetime.now().strftime("%Y%m%d-%H%M%S")}.txt")
+
+    def _beat(self):
+        self._last_beat = monotonic()
+        if self._is_running:
+            self._loop.call_later(self.slow_callback / 2, self._beat)
+
+    def _watchdog(self):
+        reported_beat = None
+
+        while self._is_running:
+            sleep(self.slow_callback / 2)
+            # Next beat is expected half of the threshold after the last one
+            lag = monotonic() - self._last_beat - self.slow_callback / 2
+            if lag > self.slow_callback and reported_beat != self._last_beat:
+                reported_beat = self._last_beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<unknown>"
+                self._logger.warning(f"Event loop is blocked for {lag:.3f}s, current stack:\n{stack}")
+
+    def start_sampling(self, duration: Optional[float]=None):
+        if self._is_sampling:
+            self._logger.warning("Profiler is already sampling")
+            return
+
+        self._is_sampling = True
+        threading.Thread(target=self._sample, args=(duration or self.sample_duration,), name="profiler-sampler", daemon=True).start()
+        self._logger.info(f"Started sampling event loop for {duration or self.sample_duration}s")
+
+    def _sample(self, duration: float):
+        samples: Counter[str] = Counter()
+        finish_at = monotonic() + duration
+
+        try:
+            while monotonic() < finish_at:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    samples[_collapse_stack(frame)] += 1
+                sleep(self.sample_interval)
+
+            path = self._output_path("profile")
+            with open(path, "w", encoding="utf-8") as file:
+                for stack, hits in samples.most_common():
+                    file.write(f"{stack} {hits}\n")
+            self._logger.info(f"Saved event loop profile ({sum(samples.values())} samples) to {path}")
+        finally:
+            self._is_sampling = False
+
+    def dump_tasks(self):
+        path = self._output_path("tasks")
+        tasks = asyncio.all_tasks(self._loop)
+
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(f"Pending tasks: {len(tasks)}\n")
+            for key, value in (self.info() if self.info else {}).items():
+                file.write(f"{key}: {value}\n")
+            for task in tasks:
+                file.write(f"\n{task!r}\n")
+                task.print_stack(file=file)
+
+        self._logger.info(f"Saved stacks of {len(tasks)} pending tasks to {path}")
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from typing import Dict, List, Any, Optional
+from array import array
+
+import os
+import mmap
+import json
+import struct
+
+MAGIC = b"CRBREG1\0"
+HEADER_LENGTH = struct.Struct("<Q")
+ALIGNMENT = 8
+
+
+class RegistrySnapshot:
+    """
+    Columnar snapshot of pages registry.
+
+    Numeric columns are stored as raw arrays aligned to 8 bytes after JSON
+    header, so loaded snapshot is memory-mapped and columns are read
+    without parsing. Tags are stored as `tag_ids` column indexing `tags`
+    vocabulary, page `i` owns ids `tag_offsets[i]:tag_offsets[i + 1]`.
+    """
+
+    def __init__(self, page_ids: List[str], tags: List[str], columns: Dict[str, array | memoryview], meta: Optional[Dict[str, Any]]=None):
+        self.page_ids = page_ids
+        self.tags = tags
+        self.columns = columns
+        self.meta = meta or {}
+        self._mmap: Optional[mmap.mmap] = None
+
+    def __len__(self):
+        return len(self.page_ids)
+
+    def __getitem__(self, column: str) -> array | memoryview:
+        return self.columns[column]
+
+    @classmethod
+    def build(cls, rows: List[Dict[str, Any]], numeric_columns: Dict[str, str], meta: Optional[Dict[str, Any]]=None) -> RegistrySnapshot:
+        """
+        Builds snapshot from rows with `page_id`, `tags` and numeric values,
+        `numeric_columns` maps column name to its array typecode.
+        """
+        page_ids = [row["page_id"] for row in rows]
+        vocabulary: Dict[str, int] = {}
+        tag_ids = array("I")
+        tag_offsets = array("I", [0])
+
+        for row in rows:
+            for tag in row["tags"]:
+                tag_ids.append(vocabulary.setdefault(tag, len(vocabulary)))
+            tag_offsets.append(len(tag_ids))
+
+        columns: Dict[str, array | memoryview] = {
+            name: array(typecode, (row[name] for row in rows))
+            for name, typecode in numeric_columns.items()
+        }
+        columns["tag_ids"] = tag_ids
+        columns["tag_offsets"] = tag_offsets
+
+        return cls(page_ids, list(vocabulary), columns, meta)
+
+    def tag_mask(self, tag: str) -> bytearray:
+        mask = bytearray(len(self))
+        if tag not in self.tags:
+            return mask
+
+        tag_id = self.tags.index(tag)
+        tag_ids = self.columns["tag_ids"]
+        tag_offsets = self.columns["tag_offsets"]
+        row = 0
+        for position, current_id in enumerate(tag_ids):
+            if current_id != tag_id:
+                continue
+            while tag_offsets[row + 1] <= position:
+                row += 1
+            mask[row] = 1
+        return mask
+
+    def page_tags(self, row: int) -> List[str]:
+        tag_offsets = self.columns["tag_offsets"]
+        return [self.tags[tag_id] for tag_id in self.columns["tag_ids"][tag_offsets[row]:tag_offsets[row + 1]]]
+
+    def save(self, path: str):
+        header_columns = []
+        offset = 0
+        for name, column in self.columns.items():
+            offset += -offset % ALIGNMENT
+            size = len(column) * column.itemsize
+            header_columns.append({"name": name, "typecode": column.typecode if isinstance(column, array) else column.format, "offset": offset, "length": len(column)})
+            offset += size
+
+        header = json.dumps({
+            "rows": len(self),
+            "page_ids": self.page_ids,
+            "tags": self.tags,
+            "columns": header_columns,
+            "meta": self.meta,
+        }, ensure_ascii=False).encode("utf-8")
+        header += b" " * (-(len(MAGIC) + HEADER_LENGTH.size + len(header)) % ALIGNMENT)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(MAGIC)
+            file.write(HEADER_LENGTH.pack(len(header)))
+            file.write(header)
+
+            written = 0
+            for column_info, column in zip(header_columns, self.columns.values()):
+                file.write(b"\0" * (column_info["offset"] - written))
+                data = column.tobytes() if isinstance(column, array) else bytes(column)
+                file.write(data)
+                written = column_info["offset"] + len(data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> RegistrySnapshot:
+        with open(path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise ValueError(f"{path} is not a registry snapshot")
+
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        header_length, = HEADER_LENGTH.unpack_from(mapped, len(MAGIC))
+        header = json.loads(mapped[header_start:header_start + header_length])
+        data_start = header_start + header_length
+
+        view = memoryview(mapped)
+        columns: Dict[str, array | memoryview] = {}
+        for column_info in header["columns"]:
+            start = data_start + column_info["offset"]
+            size = column_info["length"] * array(column_info["typecode"]).itemsize
+            columns[column_info["name"]] = view[start:start + size].cast(column_info["typecode"])
+
+        snapshot = cls(header["page_ids"], header["tags"], columns, header["meta"])
+        snapshot._mmap = mapped
+        return snapshot
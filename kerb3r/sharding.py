@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator, List, Optional
+from contextlib import contextmanager
+from bisect import bisect
+from hashlib import md5
+from time import time
+
+import os
+import sqlite3
+import logging
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes: Optional[List[str]]=None, replicas: int=64):
+        self.replicas = replicas
+        self.nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self.set_nodes(nodes or [])
+
+    def set_nodes(self, nodes: List[str]):
+        self.nodes = sorted(set(nodes))
+        self._owners = {
+            _hash(f"{node}#{replica}"): node
+            for node in self.nodes
+            for replica in range(self.replicas)
+        }
+        self._points = sorted(self._owners)
+
+    def get_node(self, key: str) -> Optional[str]:
+        if not self._points:
+            return None
+        index = bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class PageClaimed(Exception):
+    pass
+
+
+class Coordinator:
+    """
+    Coordinates bot workers through a shared SQLite database.
+
+    Every worker holds a lease which it renews with `heartbeat`, workers
+    with expired leases are considered dead. Pages are split between live
+    workers by consistent hashing and one of them holds the leader lease
+    which is used for global actions.
+
+    Ring of a worker is refreshed only on heartbeat, so while workers join
+    or leave two of them may consider a page their own. Before changing
+    a page worker `claim`s it: ownership is checked against live workers
+    in the database and the page is leased to the worker until `release`.
+
+    Journals of workers which died are handed over to the leader.
+    """
+
+    LEADER = "leader"
+
+    def __init__(self, path: str, worker_id: str, lease: float=60, replicas: int=64):
+        self.path = path
+        self.worker_id = worker_id
+        self.lease = lease
+        self.ring = HashRing(replicas=replicas)
+        self.is_leader = False
+        self.orphaned_journals: List[str] = []
+        self._logger = logging.getLogger()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS claims (page_id TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS journals (worker_id TEXT PRIMARY KEY, path TEXT NOT NULL)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=self.lease / 2, isolation_level="IMMEDIATE")
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def heartbeat(self):
+        moment = time()
+        expires_at = moment + self.lease
+
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO workers (worker_id, expires_at) VALUES (?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET expires_at = excluded.expires_at",
+                (self.worker_id, expires_at)
+            )
+            db.execute("DELETE FROM workers WHERE expires_at <= ?", (moment,))
+            workers = [row[0] for row in db.execute("SELECT worker_id FROM workers ORDER BY worker_id")]
+
+            db.execute("UPDATE claims SET expires_at = ? WHERE holder = ?", (expires_at, self.worker_id))
+            db.execute("DELETE FROM claims WHERE expires_at <= ?", (moment,))
+
+            db.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at <= ?",
+                (self.LEADER, self.worker_id, expires_at, moment)
+            )
+            holder = db.execute("SELECT holder FROM leases WHERE name = ?", (self.LEADER,)).fetchone()[0]
+
+            if holder == self.worker_id:
+                orphaned = db.execute("SELECT path FROM journals WHERE worker_id NOT IN (SELECT worker_id FROM workers)").fetchall()
+                db.execute("DELETE FROM journals WHERE worker_id NOT IN (SELECT worker_id FROM workers)")
+                self.orphaned_journals += [row[0] for row in orphaned]
+
+        if workers != self.ring.nodes:
+            self._logger.info(f"Worker {self.worker_id}: live workers changed to {workers}")
+            self.ring.set_nodes(workers)
+
+        is_leader = holder == self.worker_id
+        if is_leader != self.is_leader:
+            self._logger.info(f"Worker {self.worker_id}: {"acquired" if is_leader else "lost"} leadership")
+        self.is_leader = is_leader
+
+    def leave(self):
+        with self._connect() as db:
+            db.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+            db.execute("DELETE FROM leases WHERE holder = ?", (self.worker_id,))
+            db.execute("DELETE FROM claims WHERE holder = ?", (self.worker_id,))
+        self.is_leader = False
+
+    def register_journal(self, path: str):
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO journals (worker_id, path) VALUES (?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET path = excluded.path",
+                (self.worker_id, os.path.abspath(path))
+            )
+
+    def take_orphaned_journals(self) -> List[str]:
+        orphaned, self.orphaned_journals = self.orphaned_journals, []
+        return orphaned
+
+    def owns(self, key: str) -> bool:
+        owner = self.ring.get_node(key)
+        return owner is None or owner == self.worker_id
+
+    def claim(self, page_id: str, leader_only: bool=False, any_owner: bool=False) -> bool:
+        """
+        Leases the page to this worker if it owns the page according to live
+        workers in the database, or holds the leader lease if `leader_only`
+        is set. Neither is checked with `any_owner`, which is meant for
+        resuming actions started before ownership changed.
+
+        Returns false if the page is not owned or is claimed by another worker.
+        """
+        moment = time()
+
+        with self._connect() as db:
+            if any_owner:
+                pass
+            elif leader_only:
+                if db.execute("SELECT 1 FROM leases WHERE name = ? AND holder = ? AND expires_at > ?", (self.LEADER, self.worker_id, moment)).fetchone() is None:
+                    return False
+            else:
+                workers = [row[0] for row in db.execute("SELECT worker_id FROM workers WHERE expires_at > ? ORDER BY worker_id", (moment,))]
+                ring = self.ring if workers == self.ring.nodes else HashRing(workers, self.ring.replicas)
+                if ring.get_node(page_id) not in (None, self.worker_id):
+                    return False
+
+            cursor = db.execute(
+                "INSERT INTO claims (page_id, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (page_id) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE claims.holder = excluded.holder OR claims.expires_at <= ?",
+                (page_id, self.worker_id, moment + self.lease, moment)
+            )
+            return cursor.rowcount > 0
+
+    def release(self, page_id: str):
+        with self._connect() as db:
+            db.execute("DELETE FROM claims WHERE page_id = ? AND holder = ?", (page_id, self.worker_id))
@@ -1,4 +1,4 @@
-from typing import Any, List
+from typing import Any, Callable, List, Optional
 from uuid import uuid4
 from datetime import datetime, timezone
 
@@ -32,4 +32,11 @@ def now(tz: timezone=timezone.utc) -> datetime:
     return datetime.now(tz)
 
 def never(tz: timezone=timezone.utc) -> datetime:
-    return datetime(year=1, month=1, day=1, tzinfo=tz)
\ No newline at end of file
+    return datetime(year=1, month=1, day=1, tzinfo=tz)
+
+def fast_json_loads() -> Optional[Callable[[str | bytes], Any]]:
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson.loads
\ No newline at end of file
@@ -1,25 +1,45 @@
 from __future__ import annotations
 
-from typing import Iterable, Optional, Dict, Any, List
+from typing import AsyncIterator, Callable, Iterable, Optional, Dict, Any, List, Tuple
 from functools import cached_property
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime
 from enum import Enum, auto
 from aiohttp import ClientSession
 from copy import deepcopy
 from yarl import URL
+from time import monotonic
 
 from .utils import lazy_async, never, page_category, normalize_tag
+from .cache import WikiCache, ResponseCache
+from .workqueue import RateLimiter
 
-import inspect
 import logging
+import json
+
+_deserializers: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
 
 class APIData:
+    __slots__ = ()
+
+    # Field name -> function converting raw API value of the field
+    _converters: Dict[str, Callable[[Any], Any]] = {}
+
+    @classmethod
+    def _make_deserializer(cls) -> Callable[[Dict[str, Any]], Any]:
+        converters = tuple((field.name, cls._converters.get(field.name)) for field in fields(cls) if field.init)
+
+        def deserialize(parameters: Dict[str, Any]) -> Any:
+            return cls(*[parameters[name] if convert is None else convert(parameters[name]) for name, convert in converters])
+
+        return deserialize
+
     @classmethod
     def from_dict(cls, parameters):
-        allowed_parameters = inspect.signature(cls).parameters
-        filtered_parameters = {k: v for k, v in parameters.items() if k in allowed_parameters}
-        return cls(**filtered_parameters)
+        deserializer = _deserializers.get(cls)
+        if deserializer is None:
+            deserializer = _deserializers[cls] = cls._make_deserializer()
+        return deserializer(parameters)
 
 class Method(Enum):
     GET = auto()
@@ -53,7 +73,7 @@ class Module(Enum):
     ForumNewPost = "forumnewpost"
     ForumThread = "forumthread"
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class User(APIData):
     type: str
     id: int
@@ -75,7 +95,7 @@ class LogEntryType(Enum):
     Revert = "revert"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LogEntry(APIData):
     revNumber: int
     user: User
@@ -84,24 +104,29 @@ class LogEntry(APIData):
     type: str
     meta: Dict[str, Any]
 
-    @classmethod
-    def from_dict(cls, parameters) -> LogEntry:
-        parameters["createdAt"] = datetime.fromisoformat(parameters["createdAt"])
-        parameters["user"] = User.from_dict(parameters["user"])
-        return super().from_dict(parameters)
+    _converters = {
+        "user": User.from_dict,
+        "createdAt": datetime.fromisoformat,
+    }
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Vote(APIData):
     user: User
     value: float
 
+    _converters = {
+        "user": User.from_dict,
+    }
+
 class VotesMode(Enum):
     UpDown = "updown"
     Stars = "stars"
     Disabled = "disabled"
 
-@dataclass
+_VOTES_MODES = {mode.value: mode for mode in VotesMode}
+
+@dataclass(slots=True)
 class PageMeta:
     name: Optional[str] = None
     title: Optional[str] = None
@@ -114,6 +139,22 @@ class PageMeta:
     votes_mode: Optional[VotesMode] = None
     tags: Optional[List[str]] = None
 
+    @classmethod
+    def from_article(cls, data: Dict[str, Any]) -> PageMeta:
+        rating = data["rating"]
+        return cls(
+            data["pageId"],
+            data["title"],
+            User.from_dict(data["createdBy"]),
+            datetime.fromisoformat(data["createdAt"]),
+            datetime.fromisoformat(data["updatedAt"]),
+            rating["value"],
+            rating["popularity"],
+            rating["votes"],
+            _VOTES_MODES[rating["mode"]],
+            data["tags"]
+        )
+
 class Page:
     def __init__(self, wiki: Wiki, page_id: str):
         self.wiki = wiki
@@ -121,6 +162,8 @@ class Page:
 
         self._raw_data = None
         self._article_log = None
+        self._history: List[LogEntry] = []
+        self._history_source = None
         self._votes_info = None
         self._meta: PageMeta = PageMeta()
 
@@ -143,6 +186,8 @@ class Page:
     async def update_data(self, data: Any) -> Any:
         if "pageId" not in data:
             data["pageId"] = self.page_id
+        self.wiki.cache.invalidate_article_log(self.page_id)
+        self.wiki.record_write(self.page_id, data["pageId"])
         return await self.wiki.api(Endpoint.Article.get_endpoint_route(self.page_id, Method.PUT), json=data)
 
     @property
@@ -171,7 +216,17 @@ class Page:
     def history(self) -> List[LogEntry]:
         if not self._article_log:
             return []
-        return [LogEntry.from_dict(entry) for entry in deepcopy(self._article_log["entries"])]
+        # Parsed once per loaded log, entries are immutable
+        if self._history_source is not self._article_log:
+            self._history = [LogEntry.from_dict(entry) for entry in self._article_log["entries"]]
+            self._history_source = self._article_log
+        return self._history
+
+    @property
+    def revision(self) -> int | None:
+        if not self._article_log:
+            return None
+        return self._article_log["count"]
 
     @property
     def created_at(self) -> datetime:
@@ -208,7 +263,9 @@ class Page:
     
     async def filter_history(self, types: Optional[List[LogEntryType] | List[str]]=None, lazy: bool=True) -> List[LogEntry]:
         await lazy_async(lazy, self.history is None, self.get_change_log)
+        return self.find_history(types)
 
+    def find_history(self, types: Optional[List[LogEntryType] | List[str]]=None) -> List[LogEntry]:
         if not types:
             return self.history
 
@@ -223,7 +280,7 @@ class Page:
         return self._raw_data
     
     async def get_change_log(self) -> Any:
-        self._article_log = await self.wiki.api(Endpoint.ArticleLog.get_endpoint_route(self.page_id), params={"all": "true"})
+        self._article_log = await self.wiki.get_article_log(self.page_id)
         history = self.history
 
         self._meta.created_at = history[-1].createdAt
@@ -240,8 +297,10 @@ class Page:
     
     async def get_last_category_move(self, lazy: bool=True) -> LogEntry:
         await lazy_async(lazy, self.history is None, self.get_change_log)
+        return self.find_last_category_move()
 
-        for entry in await self.filter_history([LogEntryType.Name]):
+    def find_last_category_move(self) -> LogEntry:
+        for entry in self.find_history([LogEntryType.Name]):
             new_category = page_category(entry.meta["name"])
             prev_category = page_category(entry.meta["prev_name"])
             if new_category == self.category and new_category != prev_category:
@@ -251,19 +310,27 @@ class Page:
     
     async def get_last_source_edit(self, lazy: bool=True) -> LogEntry:
         await lazy_async(lazy, self.history is None, self.get_change_log)
+        return self.find_last_source_edit()
 
-        edits = await self.filter_history([LogEntryType.Source, LogEntryType.New])
-        return edits[0]
+    def find_last_source_edit(self) -> LogEntry:
+        return self.find_history([LogEntryType.Source, LogEntryType.New])[0]
     
     async def get_tag_date(self, tag: str, lazy: bool=True) -> datetime | None:
         await lazy_async(lazy, self.tags is None, self.get_page_data)
 
+        if normalize_tag(tag) not in self.tags:
+            return None
+
+        await lazy_async(lazy, self.history is None, self.get_change_log)
+        return self.find_tag_date(tag)
+
+    def find_tag_date(self, tag: str) -> datetime | None:
         normalized_tag = normalize_tag(tag)
 
         if normalized_tag not in self.tags:
             return None
         
-        for entry in await self.filter_history([LogEntryType.Tags]):
+        for entry in self.find_history([LogEntryType.Tags]):
             if normalized_tag in [tag_entry["name"] for tag_entry in entry.meta["added_tags"]]:
                 return entry.createdAt
             
@@ -313,18 +380,19 @@ class Page:
         return removed_tags
 
     async def delete_page(self) -> Any:
-        return await self.wiki.api(Endpoint.Article.get_endpoint_route(self.page_id, Method.DELETE))
+        self.wiki.record_write(self.page_id)
+        result = await self.wiki.api(Endpoint.Article.get_endpoint_route(self.page_id, Method.DELETE))
+        self.wiki.cache.drop(self.page_id)
+        return result
 
     async def rename(self, new_id: str) -> str:
         result = await self.update_data({"pageId": new_id, "forcePageId": True})
+        self.wiki.cache.rename(self.page_id, result['pageId'])
         self.page_id = result['pageId']
         return self.page_id
 
     async def get_thread(self) -> ForumThread:
-        return ForumThread(
-            self.wiki,
-            (await self.wiki.module(Module.ForumThread, "for_article", pageId=self.page_id))["threadId"]
-        )
+        return ForumThread(self.wiki, await self.wiki.get_thread_id(self.page_id))
 
 
 class ForumThread:
@@ -342,13 +410,19 @@ class ForumThread:
 
 
 class Wiki:
-    def __init__(self, wiki_base: str, token: Optional[str]=None):
+    def __init__(self, wiki_base: str, token: Optional[str]=None, response_cache: Optional[ResponseCache]=None):
         self.wiki_base = URL(wiki_base)
         self.token = token
         self._logger = logging.getLogger()
         self._session: Optional[ClientSession] = None
         self._api_url = URL("/api/")
         self.is_api_initialized = False
+        self.cache = WikiCache()
+        self.limiter: Optional[RateLimiter] = None
+        self.responses = response_cache
+        self.json_loads: Callable[[str | bytes], Any] = json.loads
+        # Page id -> monotonic time of the last change made by the bot
+        self.written_at: Dict[str, float] = {}
 
     async def _init_api(self):
         self._session = ClientSession(self.wiki_base)
@@ -371,13 +445,37 @@ class Wiki:
         else:
             route = endpoint
 
+        if self.limiter:
+            await self.limiter.acquire()
+
         self._logger.debug(f"API call to endpoint: {self.wiki_base.join(self._api_url) / route.endpoint} with args: {args} and kwargs: {kwargs}")
         
+        cache_key = None
+        cached_body = None
+        if self.responses is not None and not raw and route.method == Method.GET:
+            cache_key = ResponseCache.make_key(route.method.name, route.endpoint, kwargs.get("params"))
+            validators, cached_body = self.responses.validators(cache_key)
+            if validators:
+                kwargs["headers"] = {**validators, **kwargs.get("headers", {})}
+
         resp = await self._session.request(route.method.name, self._api_url / route.endpoint, *args, **kwargs)
         if raw:
             return resp
+
+        if cache_key is None:
+            resp.raise_for_status()
+            return await resp.json(loads=self.json_loads)
+
+        if resp.status == 304:
+            resp.release()
+            if cached_body is not None:
+                return self.json_loads(self.responses.hit(cache_key, cached_body))
+            raise ValueError(f"Got 304 for not cached response of {route.endpoint}")
+
         resp.raise_for_status()
-        return await resp.json()
+        body = await resp.read()
+        self.responses.store(cache_key, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), body)
+        return self.json_loads(body)
         
     async def get_page(self, page_id: str, lazy: bool=True) -> Page:
         if lazy:
@@ -385,26 +483,65 @@ class Wiki:
         return await Page(self, page_id).fetch()
     
     async def is_page_exists(self, page_id: str):
-        log =  await self.api(Endpoint.ArticleLog.get_endpoint_route(page_id))
-        return log["count"] > 0
+        return await self.get_article_log_count(page_id) > 0
+
+    async def get_article_log_count(self, page_id: str) -> int:
+        log = await self.api(Endpoint.ArticleLog.get_endpoint_route(page_id))
+        return log["count"]
+
+    async def get_article_log(self, page_id: str) -> Any:
+        log = self.cache.get_article_log(page_id)
+        if log is not None:
+            return log
+
+        if self.cache.has_article_log(page_id):
+            log = self.cache.revalidate_article_log(page_id, await self.get_article_log_count(page_id))
+            if log is not None:
+                return log
+
+        log = await self.api(Endpoint.ArticleLog.get_endpoint_route(page_id), params={"all": "true"})
+        self.cache.set_article_log(page_id, log)
+        return log
+
+    def record_write(self, *page_ids: str):
+        moment = monotonic()
+        for page_id in page_ids:
+            self.written_at[page_id] = moment
+
+    def forget_writes(self, before: float):
+        self.written_at = {page_id: moment for page_id, moment in self.written_at.items() if moment >= before}
+
+    async def page_exists(self, page_id: str) -> bool:
+        resp = await self.api(Endpoint.Article.get_endpoint_route(page_id), raw=True)
+        resp.release()
+        if resp.status == 404:
+            return False
+        resp.raise_for_status()
+        return True
+
+    async def get_thread_id(self, page_id: str) -> Any:
+        thread_id = self.cache.get_thread_id(page_id)
+        if thread_id is None:
+            thread_id = (await self.module(Module.ForumThread, "for_article", pageId=page_id))["threadId"]
+            self.cache.set_thread_id(page_id, thread_id)
+        return thread_id
     
+    async def get_page_fingerprints(self) -> Dict[str, Tuple]:
+        """
+        Fingerprints of all pages taken from the registry, which change
+        with page contents, tags and votes.
+        """
+        return {
+            data["pageId"]: (data["updatedAt"], data["rating"]["value"], data["rating"]["votes"], data["rating"]["popularity"], tuple(sorted(data["tags"])))
+            for data in await self.api(Endpoint.Articles)
+        }
+
     async def get_all_pages(self):
         all_pages_json = await self.api(Endpoint.Articles)
         all_pages = []
         for page_data in all_pages_json:
             page = Page(self, page_data["pageId"])
-            page._meta = PageMeta(
-                name=page_data["pageId"],
-                title=page_data["title"],
-                author=User.from_dict(page_data["createdBy"]),
-                created_at=datetime.fromisoformat(page_data["createdAt"]),
-                updated_at=datetime.fromisoformat(page_data["updatedAt"]),
-                rating=page_data["rating"]["value"],
-                popularity=page_data["rating"]["popularity"],
-                votes_count=page_data["rating"]["votes"],
-                votes_mode=VotesMode(page_data["rating"]["mode"]),
-                tags=page_data["tags"]
-            )
+            page._meta = PageMeta.from_article(page_data)
             all_pages.append(page)
         return all_pages
         
@@ -421,6 +558,15 @@ class Wiki:
     
     async def list_pages(self, **params) -> List[Page]:
         return [await self.get_page(page_id) for page_id in (await self._raw_list_pages(**params))["pages"]]
+
+    async def iter_pages(self, **params) -> AsyncIterator[Page]:
+        """
+        Streams pages of the listing one by one. Listing is requested at
+        once: offset pagination skips pages which leave the listing while
+        it is iterated, and the module offers no stable cursor.
+        """
+        for page_id in (await self._raw_list_pages(**params))["pages"]:
+            yield await self.get_page(page_id)
     
     @staticmethod
     async def filter_pages(pages: List[Page], categories: str="_default", tags: str="", lazy: bool=True) -> list[Page]:
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+from typing import Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+from dataclasses import dataclass, field
+from functools import partial
+from enum import IntEnum
+from itertools import count
+from time import monotonic
+
+import asyncio
+import heapq
+import logging
+
+
+class Priority(IntEnum):
+    Critical = 0
+    High = 1
+    Normal = 2
+    Low = 3
+
+
+class WorkItemExpired(Exception):
+    pass
+
+
+@dataclass(order=True)
+class WorkItem:
+    priority: int
+    seq: int
+    action: Callable[[], Awaitable[Any]] = field(compare=False)
+    task: str = field(compare=False)
+    submitted_at: float = field(compare=False)
+    deadline: Optional[float] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class TaskStats:
+    processed: int = 0
+    failed: int = 0
+    expired: int = 0
+    total_wait: float = 0
+    max_wait: float = 0
+
+    @property
+    def avg_wait(self) -> float:
+        done = self.processed + self.failed
+        return self.total_wait / done if done else 0
+
+
+class RateLimiter:
+    """
+    Token bucket limiting amount of requests per second.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float]=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated_at = monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        moment = monotonic()
+        self._tokens = min(self.burst, self._tokens + (moment - self._updated_at) * self.rate)
+        self._updated_at = moment
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+async def _aiter(items: Iterable[Any] | AsyncIterable[Any]) -> AsyncIterator[Any]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class WorkQueue:
+    """
+    Shared queue of per-page work items of all bot tasks.
+
+    Items are executed by a fixed pool of workers in order of priority,
+    items of the same priority are shared fairly between tasks. Item which
+    waited in the queue longer than its deadline is dropped.
+
+    Each `map` call keeps at most `max_pending` submitted items, so items
+    can be streamed from async iterable without being collected first.
+    """
+
+    def __init__(self, concurrency: int=1, max_pending: Optional[int]=None):
+        if concurrency < 1:
+            raise ValueError("Work queue concurrency must be at least one.")
+
+        self.concurrency = concurrency
+        self.max_pending = max_pending or concurrency * 2
+        self._queues: Dict[str, List[WorkItem]] = {}
+        self._served: Dict[str, int] = {}
+        self._stats: Dict[str, TaskStats] = {}
+        self._seq = count()
+        self._available: Optional[asyncio.Condition] = None
+        self._workers: List[asyncio.Task] = []
+        self._logger = logging.getLogger()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            task: {
+                "queued": len(self._queues.get(task, [])),
+                "processed": stats.processed,
+                "failed": stats.failed,
+                "expired": stats.expired,
+                "avg_wait": round(stats.avg_wait, 3),
+                "max_wait": round(stats.max_wait, 3),
+            }
+            for task, stats in self._stats.items()
+        }
+
+    def _start(self):
+        if self._available is None:
+            self._available = asyncio.Condition()
+        # Workers which died are replaced, so the pool does not shrink
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        self._workers += [asyncio.create_task(self._worker()) for _ in range(self.concurrency - len(self._workers))]
+
+    def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    async def submit(self, action: Callable[[], Awaitable[Any]], priority: int=Priority.Normal, task: str="default", deadline: Optional[float]=None) -> asyncio.Future:
+        self._start()
+
+        submitted_at = monotonic()
+        item = WorkItem(
+            int(priority),
+            next(self._seq),
+            action,
+            task,
+            submitted_at,
+            submitted_at + deadline if deadline is not None else None,
+            asyncio.get_running_loop().create_future()
+        )
+
+        queue = self._queues.setdefault(task, [])
+        if not queue:
+            # Newly active task should not starve the others because of its past idleness
+            active_served = [self._served[other] for other, other_queue in self._queues.items() if other_queue]
+            self._served[task] = max(self._served.get(task, 0), min(active_served, default=0))
+        heapq.heappush(queue, item)
+        self._stats.setdefault(task, TaskStats())
+
+        async with self._available:
+            self._available.notify()
+
+        return item.future
+
+    async def map(self, handler: Callable[[Any], Awaitable[Any]], items: Iterable[Any] | AsyncIterable[Any], priority: int=Priority.Normal, task: str="default", deadline: Optional[float]=None) -> int:
+        slots = asyncio.Semaphore(self.max_pending)
+        pending: set[asyncio.Future] = set()
+        submitted = 0
+
+        def on_done(item: Any, future: asyncio.Future):
+            pending.discard(future)
+            slots.release()
+
+            if future.cancelled():
+                return
+            error = future.exception()
+            if isinstance(error, WorkItemExpired):
+                self._logger.warning(f"Work item of task {task} expired in queue: {item}")
+            elif error is not None:
+                self._logger.error(f"Work item of task {task} failed: {item}", exc_info=error)
+
+        async for item in _aiter(items):
+            await slots.acquire()
+            future = await self.submit(lambda item=item: handler(item), priority, task, deadline)
+            pending.add(future)
+            future.add_done_callback(partial(on_done, item))
+            submitted += 1
+
+        if pending:
+            await asyncio.wait(pending)
+
+        return submitted
+
+    def _next_item(self) -> Optional[WorkItem]:
+        candidates = [task for task, queue in self._queues.items() if queue]
+        if not candidates:
+            return None
+
+        best_priority = min(self._queues[task][0].priority for task in candidates)
+        task = min(
+            (task for task in candidates if self._queues[task][0].priority == best_priority),
+            key=lambda task: self._served[task]
+        )
+
+        self._served[task] += 1
+        return heapq.heappop(self._queues[task])
+
+    async def _worker(self):
+        while True:
+            async with self._available:
+                item = self._next_item()
+                while item is None:
+                    await self._available.wait()
+                    item = self._next_item()
+
+            stats = self._stats[item.task]
+            started_at = monotonic()
+            if item.deadline is not None and started_at > item.deadline:
+                stats.expired += 1
+                item.future.set_exception(WorkItemExpired())
+                continue
+
+            wait = started_at - item.submitted_at
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+
+            try:
+                item.future.set_result(await item.action())
+                stats.processed += 1
+            except asyncio.CancelledError:
+                item.future.cancel()
+                # Cancellation raised by the action itself does not stop the worker
+                if asyncio.current_task().cancelling():
+                    raise
+                stats.failed += 1
+            except Exception as e:
+                stats.failed += 1
+                item.future.set_exception(e)
@@ -0,0 +1,236 @@
+"""
+Offline evaluation of config changes against a snapshot of pages registry.
+
+    python whatif.py dump [-o logs/registry.bin]
+    python whatif.py eval candidate.yml [-s logs/registry.bin]
+
+Candidate config is merged over config.yml, so it may contain only the
+changed parameters.
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import datetime
+from math import nan
+from time import perf_counter
+from typing import Any, Dict, List
+
+import asyncio
+
+from kerb3r.wiki import Wiki, Page
+from kerb3r.registry import RegistrySnapshot
+from kerb3r.workqueue import WorkQueue, RateLimiter
+from kerb3r.utils import page_category, now
+from config import config, load_config, lookup, extract_period, API_TOKEN, _config
+
+
+NUMERIC_COLUMNS = {
+    "rating": "d",
+    "popularity": "d",
+    "votes": "q",
+    "deletion_tag_date": "d",
+    "whitemark_tag_date": "d",
+    "category_move_date": "d",
+    "source_edit_date": "d",
+}
+
+OUTCOMES = ["archive", "whitemark", "mark_deletion", "unmark_deletion", "delete", "approve", "unwhitemark", "archive_in_progress"]
+
+
+def timestamp(moment: datetime | None) -> float:
+    return moment.timestamp() if moment else nan
+
+
+def merge_config(base: Any, overlay: Any) -> Any:
+    if not isinstance(base, dict) or not isinstance(overlay, dict):
+        return overlay
+    merged = dict(base)
+    for key, value in overlay.items():
+        merged[key] = merge_config(base.get(key), value)
+    return merged
+
+
+async def dump(output: str, concurrency: int):
+    wiki = Wiki(config("wiki_base_url"), token=API_TOKEN)
+    if config("runtime.queue.requests_per_second"):
+        wiki.limiter = RateLimiter(config("runtime.queue.requests_per_second"))
+
+    tracked_categories = set(config("deletion.categories") + config("in_progress.categories"))
+    rows: List[Dict[str, Any]] = []
+
+    async def collect(page: Page):
+        row = {
+            "page_id": page.name,
+            "tags": page.tags,
+            "rating": page.rating or 0,
+            "popularity": page.popularity or 0,
+            "votes": page.votes_count or 0,
+            "deletion_tag_date": nan,
+            "whitemark_tag_date": nan,
+            "category_move_date": nan,
+            "source_edit_date": nan,
+        }
+
+        if page.category in tracked_categories:
+            await page.get_change_log()
+            edits = page.find_history(["source", "new"])
+            row.update(
+                deletion_tag_date=timestamp(page.find_tag_date(config("tags.deletion"))),
+                whitemark_tag_date=timestamp(page.find_tag_date(config("tags.whitemark"))),
+                category_move_date=timestamp(page.find_last_category_move().createdAt),
+                source_edit_date=timestamp(edits[0].createdAt if edits else None),
+            )
+
+        rows.append(row)
+
+    queue = WorkQueue(concurrency)
+    try:
+        pages = await wiki.get_all_pages()
+        print(f"Registry contains {len(pages)} pages, fetching history of {sum(page.category in tracked_categories for page in pages)}")
+        await queue.map(collect, pages, task="dump")
+    finally:
+        queue.stop()
+        await wiki._close_api()
+
+    snapshot = RegistrySnapshot.build(rows, NUMERIC_COLUMNS, meta={
+        "created_at": now().timestamp(),
+        "wiki": config("wiki_base_url"),
+        "tags": {"deletion": config("tags.deletion"), "whitemark": config("tags.whitemark")},
+    })
+    snapshot.save(output)
+    print(f"Saved snapshot of {len(snapshot)} pages to {output}")
+
+
+def any_tag_mask(snapshot: RegistrySnapshot, tags: List[str]) -> bytearray:
+    mask = bytearray(len(snapshot))
+    for tag in tags:
+        for row, has_tag in enumerate(snapshot.tag_mask(tag)):
+            if has_tag:
+                mask[row] = 1
+    return mask
+
+
+def evaluate(snapshot: RegistrySnapshot, cfg: Dict[str, Any], moment: float) -> List[str]:
+    """
+    Mirrors decisions of bot tasks for every page of the snapshot.
+    Returns outcome per page, empty string if page is left as is.
+    """
+    def get(param: str) -> Any:
+        return lookup(cfg, param)
+
+    def delay(param: str) -> float:
+        return extract_period(get(param)).total_seconds()
+
+    deletion_categories = set(get("deletion.categories"))
+    in_progress_categories = set(get("in_progress.categories"))
+    critical_rating, critical_votes, critical_popularity = get("critical.rating"), get("critical.votes"), get("critical.popularity")
+    approval_rating, approval_votes, approval_popularity = get("approval.rating"), get("approval.votes"), get("approval.popularity")
+    critical_delay, approval_delay = delay("critical.delay"), delay("approval.delay")
+    grayzone_delay, in_progress_delay = delay("grayzone.delay"), delay("in_progress.delay")
+
+    branch = any_tag_mask(snapshot, get("deletion.branch_tags"))
+    excluded = any_tag_mask(snapshot, get("tags.exclude_with"))
+    deletion = snapshot.tag_mask(get("tags.deletion"))
+    whitemark = snapshot.tag_mask(get("tags.whitemark"))
+    approved = snapshot.tag_mask(get("tags.approved"))
+
+    ratings, popularities, votes = snapshot["rating"], snapshot["popularity"], snapshot["votes"]
+    deletion_dates, whitemark_dates = snapshot["deletion_tag_date"], snapshot["whitemark_tag_date"]
+    category_move_dates, source_edit_dates = snapshot["category_move_date"], snapshot["source_edit_date"]
+
+    outcomes = [""] * len(snapshot)
+
+    for row, page_id in enumerate(snapshot.page_ids):
+        if not branch[row] or excluded[row]:
+            continue
+
+        category = page_category(page_id)
+        rating, popularity, votes_count = ratings[row], popularities[row], votes[row]
+        critical = rating < critical_rating and votes_count >= critical_votes
+        approval = votes_count >= approval_votes and popularity >= approval_popularity and rating >= approval_rating
+
+        if category in deletion_categories:
+            if deletion[row]:
+                if not critical:
+                    outcomes[row] = "unmark_deletion"
+                elif moment - deletion_dates[row] >= critical_delay:
+                    outcomes[row] = "delete"
+            elif whitemark[row]:
+                if approved[row]:
+                    continue
+                if approval and moment - whitemark_dates[row] >= approval_delay:
+                    outcomes[row] = "approve"
+                elif not approval:
+                    outcomes[row] = "unwhitemark"
+            elif not approved[row]:
+                if rating > critical_rating and popularity < critical_popularity and moment - category_move_dates[row] >= grayzone_delay:
+                    outcomes[row] = "archive"
+                elif approval:
+                    outcomes[row] = "whitemark"
+                elif critical:
+                    outcomes[row] = "mark_deletion"
+
+        elif category in in_progress_categories:
+            if moment - source_edit_dates[row] >= in_progress_delay:
+                outcomes[row] = "archive_in_progress"
+
+    return outcomes
+
+
+def compare(snapshot_path: str, candidate_path: str, limit: int):
+    snapshot = RegistrySnapshot.load(snapshot_path)
+    candidate = merge_config(_config, load_config(candidate_path) or {})
+    moment = snapshot.meta.get("created_at", now().timestamp())
+
+    for tag in ("deletion", "whitemark"):
+        if lookup(candidate, f"tags.{tag}") != snapshot.meta.get("tags", {}).get(tag):
+            print(f"Warning: snapshot has dates of tag {snapshot.meta.get("tags", {}).get(tag)}, not {lookup(candidate, f"tags.{tag}")}")
+
+    started_at = perf_counter()
+    current_outcomes = evaluate(snapshot, _config, moment)
+    candidate_outcomes = evaluate(snapshot, candidate, moment)
+    elapsed = perf_counter() - started_at
+
+    current_counts = Counter(current_outcomes)
+    candidate_counts = Counter(candidate_outcomes)
+
+    print(f"Snapshot of {len(snapshot)} pages taken at {datetime.fromtimestamp(moment).strftime("%d.%m.%Y %H:%M:%S")}, evaluated in {elapsed * 1000:.1f} ms")
+    print(f"{"outcome":<20} {"current":>8} {"candidate":>10} {"diff":>6}")
+    for outcome in OUTCOMES:
+        diff = candidate_counts[outcome] - current_counts[outcome]
+        print(f"{outcome:<20} {current_counts[outcome]:>8} {candidate_counts[outcome]:>10} {diff:>+6}")
+
+    changed = [
+        (page_id, current, new)
+        for page_id, current, new in zip(snapshot.page_ids, current_outcomes, candidate_outcomes)
+        if current != new
+    ]
+    print(f"\nPages with changed outcome: {len(changed)}")
+    for page_id, current, new in changed[:limit]:
+        print(f"  {page_id}: {current or "-"} -> {new or "-"}")
+    if len(changed) > limit:
+        print(f"  ... and {len(changed) - limit} more")
+
+
+def main():
+    parser = ArgumentParser(description="Evaluates config changes against registry snapshot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dump_parser = subparsers.add_parser("dump", help="dump pages registry to snapshot file")
+    dump_parser.add_argument("-o", "--output", default="logs/registry.bin")
+    dump_parser.add_argument("-c", "--concurrency", type=int, default=config("runtime.queue.concurrency", 1))
+
+    eval_parser = subparsers.add_parser("eval", help="compare outcomes of candidate config with current one")
+    eval_parser.add_argument("candidate", help="yml file with changed config parameters")
+    eval_parser.add_argument("-s", "--snapshot", default="logs/registry.bin")
+    eval_parser.add_argument("-l", "--limit", type=int, default=20, help="max pages with changed outcome to print")
+
+    args = parser.parse_args()
+    if args.command == "dump":
+        asyncio.run(dump(args.output, args.concurrency))
+    else:
+        compare(args.snapshot, args.candidate, args.limit)
+
+
+if __name__ == "__main__":
+    main()